@@ -9,15 +9,18 @@ https://docs.djangoproject.com/en/4.2/topics/settings/
 For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
+import hashlib
 import os
+import tempfile
 from pathlib import Path
 from dotenv import load_dotenv
 
-load_dotenv()
-
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# Явный путь: без него load_dotenv ищет .env, разбирая стек вызовов и поднимаясь по каталогам
+load_dotenv(BASE_DIR / '.env')
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/4.2/howto/deployment/checklist/
@@ -30,6 +33,41 @@ DEBUG = os.getenv('DEBUG', 'False') == 'True'
 
 ALLOWED_HOSTS = ['127.0.0.1', 'localhost', '.pythonanywhere.com']
 
+# Режим админки для больших таблиц цитат: оценка количества строк и переход по курсору
+QUOTES_ADMIN_HIGH_VOLUME = os.getenv('QUOTES_ADMIN_HIGH_VOLUME', 'False') == 'True'
+
+# Шардированные счетчики: цитата с большим числом голосов в минуту пишет голоса
+# в несколько строк вместо одной (см. quotes.counters)
+QUOTES_COUNTER_SHARDS = 8
+QUOTES_HOT_VOTES_PER_MINUTE = int(os.getenv('QUOTES_HOT_VOTES_PER_MINUTE', '120'))
+
+# Прогрев процесса при старте: шаблоны, данные для случайного выбора, статистика
+# (см. quotes.warmup). Включается в окружении WSGI-сервера
+QUOTES_WARMUP = os.getenv('QUOTES_WARMUP', 'False') == 'True'
+
+# Отложенные задачи (см. quotes.tasks). По умолчанию выполняются сразу; при запущенном
+# `manage.py run_worker` установите QUOTES_TASKS_SYNC=False
+QUOTES_TASKS_SYNC = os.getenv('QUOTES_TASKS_SYNC', 'True') == 'True'
+QUOTES_TASK_QUEUE_LIMIT = 10000
+# Через сколько секунд задачу упавшего обработчика можно забрать снова
+QUOTES_TASK_LEASE = 300
+
+# Файл со счетчиками поколений кэшей, общий для рабочих процессов (см. quotes.coherence).
+# В имени - хеш каталога проекта: разные копии проекта на одной машине не сбрасывают кэши друг другу
+QUOTES_COHERENCE_FILE = os.getenv(
+    'QUOTES_COHERENCE_FILE',
+    os.path.join(
+        tempfile.gettempdir(),
+        f'quotes-coherence-{hashlib.sha1(str(BASE_DIR).encode()).hexdigest()[:12]}.bin',
+    ),
+)
+
+# Профилирование запросов (см. quotes.profiling): доля случайно профилируемых
+# запросов, интервал семплирования стеков в секундах и сколько профилей хранить
+QUOTES_PROFILE_SAMPLE_RATE = float(os.getenv('QUOTES_PROFILE_SAMPLE_RATE', '0'))
+QUOTES_PROFILE_INTERVAL = 0.005
+QUOTES_PROFILE_KEEP = 200
+
 
 # Application definition
 
@@ -49,18 +87,30 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'quotes.profiling.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
 ROOT_URLCONF = 'config.urls'
 
+# Загрузчики для TEMPLATES['OPTIONS']['loaders']
+_template_loaders = [
+    'django.template.loaders.filesystem.Loader',
+    'django.template.loaders.app_directories.Loader',
+]
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [],
-        'APP_DIRS': True,
         'OPTIONS': {
+            # В продакшене шаблоны компилируются один раз на процесс. В DEBUG кэш
+            # отключен (Django 4.1+ по умолчанию кэширует и там, перезагружая
+            # измененные шаблоны через autoreload)
+            'loaders': _template_loaders if DEBUG else [
+                ('django.template.loaders.cached.Loader', _template_loaders),
+            ],
             'context_processors': [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
@@ -130,6 +180,16 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 
+# collectstatic добавляет к именам хеш содержимого и создает .gz/.br копии
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'quotes.storage.CompressedManifestStaticFilesStorage',
+    },
+}
+
 # Настройки медиа файлов
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
\ No newline at end of file
@@ -1,11 +1,21 @@
+import re
+
+from django.conf import settings
 from django.contrib import admin
-from django.urls import path, include  # Импортируем include!
+from django.urls import path, include, re_path  # Импортируем include!
+from quotes.views import serve_static
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('quotes.urls')),  # Подключаем URLs из приложения quotes
 ]
 
+if not settings.DEBUG:
+    # Статика из STATIC_ROOT, если ее не раздает веб-сервер (в DEBUG ее отдает runserver)
+    urlpatterns.append(
+        re_path(r'^%s(?P<path>.+)$' % re.escape(settings.STATIC_URL.lstrip('/')), serve_static, name='static')
+    )
+
 # Обработчики ошибок
 handler404 = 'quotes.views.handler404'
 handler500 = 'quotes.views.handler500'
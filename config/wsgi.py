@@ -9,8 +9,14 @@ https://docs.djangoproject.com/en/4.2/howto/deployment/wsgi/
 
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
 application = get_wsgi_application()
+
+# Прогрев до первого запроса (и до fork, если сервер загружает приложение в мастере)
+if settings.QUOTES_WARMUP:
+    from quotes import warmup
+    warmup.run()
@@ -1,8 +1,155 @@
-from django.contrib import admin
-from .models import Source, Quote
+from django import forms
+from django.conf import settings
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ActionForm
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList, ORDER_VAR
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Max
+from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import path, reverse
+from django.utils import timezone
+from django.utils.functional import cached_property
+from django.utils.html import format_html, format_html_join
+from .models import MAX_ID, Source, Quote, ProfileMode, RequestProfile, Task, TaskStatus, invalidate_sampling, invalidate_stats
+from . import counters, leaderboards
 
 
+# Параметр курсора для постраничного вывода без OFFSET
+KEYSET_VAR = 'after'
 
+# Фильтрованные списки считаем не дальше этого числа строк
+CAPPED_COUNT = 10000
+
+
+def estimate_row_count(model, using):
+    """Оценка числа строк таблицы без COUNT(*) (None, если оценить нельзя)"""
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [table])
+            row = cursor.fetchone()
+            # reltuples = -1, пока таблицу ни разу не анализировали
+            return row[0] if row and row[0] >= 0 else None
+        if connection.vendor == 'mysql':
+            cursor.execute(
+                'SELECT table_rows FROM information_schema.tables '
+                'WHERE table_schema = DATABASE() AND table_name = %s',
+                [table]
+            )
+            row = cursor.fetchone()
+            return row[0] if row else None
+    # Для SQLite максимальный id - дешевая верхняя оценка (поиск по первичному ключу)
+    return model._default_manager.using(using).aggregate(n=Max('pk'))['n'] or 0
+
+
+class EstimatedCountPaginator(Paginator):
+    """Пагинатор, который не выполняет полный COUNT(*) для больших таблиц"""
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimate_row_count(queryset.model, queryset.db)
+            if estimate is not None:
+                return estimate
+        # С фильтрами считаем точно, но не больше CAPPED_COUNT строк
+        return queryset[:CAPPED_COUNT].count()
+
+
+class KeysetChangeList(ChangeList):
+    """Список с переходом по курсору (id последней записи) вместо OFFSET.
+
+    Используется только при сортировке по умолчанию (по убыванию id).
+    """
+
+    def get_results(self, request):
+        if ORDER_VAR in self.params:
+            super().get_results(request)
+            self.keyset_next = None
+            return
+
+        queryset = self.queryset
+        after = getattr(request, 'quotes_keyset_after', None)
+        if after is not None:
+            queryset = queryset.filter(pk__lt=after)
+
+        # Сначала выбираем только id (индекс), затем строки текущей страницы
+        pks = list(queryset.values_list('pk', flat=True)[:self.list_per_page + 1])
+        page_pks = pks[:self.list_per_page]
+
+        self.paginator = self.model_admin.get_paginator(request, self.queryset, self.list_per_page)
+        self.result_count = self.paginator.count
+        self.full_result_count = None
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        self.result_list = self.queryset.filter(pk__in=page_pks)
+        self.can_show_all = False
+        self.multi_page = False
+        self.keyset_after = after
+        self.keyset_next = page_pks[-1] if len(pks) > self.list_per_page else None
+
+    def get_keyset_url(self, after):
+        return self.get_query_string({KEYSET_VAR: after})
+
+    @property
+    def keyset_next_url(self):
+        return self.get_keyset_url(self.keyset_next) if self.keyset_next else None
+
+    @property
+    def keyset_first_url(self):
+        return self.get_query_string(remove=[KEYSET_VAR]) if getattr(self, 'keyset_after', None) else None
+
+
+class SourceAutocompleteFilter(admin.SimpleListFilter):
+    """Фильтр по источнику с автодополнением вместо списка всех источников"""
+    title = 'Источник'
+    parameter_name = 'source__id__exact'
+    template = 'admin/quotes/source_autocomplete_filter.html'
+
+    def lookups(self, request, model_admin):
+        # Варианты не перечисляются: источник ищется через автодополнение админки
+        self.admin_site = model_admin.admin_site
+        return ()
+
+    def has_output(self):
+        return True
+
+    def queryset(self, request, queryset):
+        if self.value():
+            try:
+                source_id = int(self.value())
+            except ValueError:
+                source_id = None
+            if source_id is None or not 0 < source_id <= MAX_ID:
+                # Админка перенаправит на список без фильтров с пометкой ?e=1
+                raise IncorrectLookupParameters(f'Неверный id источника: {self.value()}')
+            return queryset.filter(source_id=source_id)
+        return queryset
+
+    def choices(self, changelist):
+        field = forms.ModelChoiceField(
+            queryset=Source.objects.all(),
+            required=False,
+            widget=AutocompleteSelect(Quote._meta.get_field('source'), self.admin_site),
+        )
+        yield {
+            'selected': self.value() is not None,
+            'widget': field.widget.render(self.parameter_name, self.value(), attrs={
+                'id': 'quotes-source-filter',
+                'style': 'width: 100%',
+            }),
+            'base_url': changelist.get_query_string(remove=[self.parameter_name, KEYSET_VAR]),
+        }
+
+
+class QuoteActionForm(ActionForm):
+    weight = forms.IntegerField(min_value=1, required=False, label='Вес')
 
 
 @admin.register(Source)
@@ -13,19 +160,183 @@ class SourceAdmin(admin.ModelAdmin):
     list_display = ('title', 'type', 'quote_count')
     list_filter = ('type',)
     search_fields = ('title',)
+    ordering = ('normalized_title', 'id')
+
+    def get_search_results(self, request, queryset, search_term):
+        # Автодополнение ищет по префиксу через индекс нормализованного названия
+        if search_term and request.path == reverse('admin:autocomplete'):
+            return queryset.title_prefix(search_term), False
+        return super().get_search_results(request, queryset, search_term)
 
 
 # Регистрация модели Quote с дополнительными настройками
 @admin.register(Quote)
 class QuoteAdmin(admin.ModelAdmin):
-    list_display = ('text_short', 'source', 'weight', 'views', 'likes', 'created_at')
-    list_filter = ('source', 'created_at')
+    list_display = ('text_short', 'source', 'weight', 'views', 'likes', 'is_active', 'created_at')
+    list_filter = (SourceAutocompleteFilter, 'is_active', 'created_at')
+    list_select_related = ('source',)
     search_fields = ('text', 'source__title')
     list_editable = ('weight',)
-    readonly_fields = ('views', 'likes', 'dislikes', 'created_at')
+    readonly_fields = ('views', 'likes', 'dislikes', 'created_at', 'archived_at')
+    action_form = QuoteActionForm
+    actions = ['set_weight', 'reset_counters', 'archive', 'restore', 'bulk_delete']
+
+    @property
+    def high_volume(self):
+        # Режим для больших таблиц: оценка количества строк и переход по курсору
+        return settings.QUOTES_ADMIN_HIGH_VOLUME
+
+    @property
+    def media(self):
+        autocomplete = AutocompleteSelect(Quote._meta.get_field('source'), self.admin_site)
+        return super().media + autocomplete.media
+
+    @property
+    def show_full_result_count(self):
+        return not self.high_volume
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        if self.high_volume:
+            return EstimatedCountPaginator(queryset, per_page, orphans, allow_empty_first_page)
+        return super().get_paginator(request, queryset, per_page, orphans, allow_empty_first_page)
+
+    def get_changelist(self, request, **kwargs):
+        if self.high_volume:
+            return KeysetChangeList
+        return super().get_changelist(request, **kwargs)
+
+    def changelist_view(self, request, extra_context=None):
+        if self.high_volume and KEYSET_VAR in request.GET:
+            # Курсор не является фильтром, поэтому убираем его из параметров списка
+            request.GET = request.GET.copy()
+            try:
+                after = int(request.GET.pop(KEYSET_VAR)[-1])
+            except ValueError:
+                after = None
+            # Курсор за пределами диапазона id переполнил бы целое в запросе; такой курсор игнорируется
+            if after is not None and 0 < after <= MAX_ID:
+                request.quotes_keyset_after = after
+        return super().changelist_view(request, extra_context)
+
+    def get_actions(self, request):
+        actions = super().get_actions(request)
+        if self.high_volume:
+            # Стандартное удаление строит страницу подтверждения со всеми объектами
+            actions.pop('delete_selected', None)
+        else:
+            # Удаление без подтверждения нужно только вместо стандартного в режиме больших таблиц
+            actions.pop('bulk_delete', None)
+        return actions
+
+    @admin.action(description='Установить вес выбранным цитатам', permissions=['change'])
+    def set_weight(self, request, queryset):
+        try:
+            weight = QuoteActionForm.base_fields['weight'].clean(request.POST.get('weight'))
+        except ValidationError:
+            weight = None
+        if weight is None:
+            self.message_user(request, 'Укажите вес (не меньше 1).', messages.ERROR)
+            return
+        updated = queryset.update(weight=weight)
+        invalidate_sampling()
+        self.message_user(request, f'Вес изменен у {updated} цитат(ы).', messages.SUCCESS)
+
+    @admin.action(description='Сбросить счетчики выбранных цитат', permissions=['change'])
+    def reset_counters(self, request, queryset):
+        updated = counters.reset(queryset)
+        invalidate_stats()
+        leaderboards.invalidate()
+        self.message_user(request, f'Счетчики сброшены у {updated} цитат(ы).', messages.SUCCESS)
+
+    @admin.action(description='Перенести выбранные цитаты в архив', permissions=['change'])
+    def archive(self, request, queryset):
+        archived = queryset.archive()
+        self.message_user(request, f'В архив перенесено {archived} цитат(ы).', messages.SUCCESS)
+
+    @admin.action(description='Вернуть выбранные цитаты из архива', permissions=['change'])
+    def restore(self, request, queryset):
+        restored = queryset.restore()
+        self.message_user(request, f'Из архива возвращено {restored} цитат(ы).', messages.SUCCESS)
+
+    @admin.action(description='Удалить выбранные цитаты (без подтверждения)', permissions=['delete'])
+    def bulk_delete(self, request, queryset):
+        # QuoteQuerySet.delete() одним UPDATE освобождает места у источников
+        deleted, _ = queryset.delete()
+        self.message_user(request, f'Удалено объектов: {deleted}.', messages.SUCCESS)
 
     # Вспомогательный метод для отображения укороченного текста цитаты
     def text_short(self, obj):
         return f'"{obj.text[:50]}..."' if len(obj.text) > 50 else f'"{obj.text}"'
 
-    text_short.short_description = 'Текст цитаты'
\ No newline at end of file
+    text_short.short_description = 'Текст цитаты'
+
+
+@admin.register(Task)
+class TaskAdmin(admin.ModelAdmin):
+    list_display = ('name', 'status', 'attempts', 'run_after', 'created_at')
+    list_filter = ('status', 'name')
+    readonly_fields = ('name', 'payload', 'dedupe_key', 'status', 'attempts', 'run_after',
+                       'locked_by', 'locked_at', 'last_error', 'created_at')
+    actions = ['retry']
+
+    def has_add_permission(self, request):
+        return False
+
+    @admin.action(description='Повторить выбранные задачи', permissions=['change'])
+    def retry(self, request, queryset):
+        updated = queryset.exclude(status=TaskStatus.PENDING).update(
+            status=TaskStatus.PENDING, attempts=0, locked_by='', locked_at=None, run_after=timezone.now()
+        )
+        self.message_user(request, f'В очередь возвращено {updated} задач(и).', messages.SUCCESS)
+
+
+@admin.register(RequestProfile)
+class RequestProfileAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'method', 'path', 'view_name', 'status_code', 'mode',
+                    'duration_ms', 'sql_count', 'sql_time_ms', 'download_link')
+    list_filter = ('mode', 'view_name')
+    search_fields = ('path',)
+    fields = ('created_at', 'method', 'path', 'view_name', 'status_code', 'mode',
+              'duration_ms', 'sql_count', 'sql_time_ms', 'download_link', 'sql_table')
+    readonly_fields = fields
+
+    # Профили создает только ProfilingMiddleware
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def get_urls(self):
+        urls = [
+            path('<int:pk>/download/', self.admin_site.admin_view(self.download_view),
+                 name='quotes_requestprofile_download'),
+        ]
+        return urls + super().get_urls()
+
+    def download_view(self, request, pk):
+        profile = get_object_or_404(RequestProfile, pk=pk)
+        if not self.has_view_permission(request, profile):
+            raise PermissionDenied
+        content_type = 'application/octet-stream' if profile.mode == ProfileMode.CPROFILE else 'text/plain; charset=utf-8'
+        response = HttpResponse(bytes(profile.data), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{profile.file_name}"'
+        return response
+
+    def download_link(self, obj):
+        url = reverse('admin:quotes_requestprofile_download', args=[obj.pk])
+        return format_html('<a href="{}">{}</a>', url, obj.file_name)
+
+    download_link.short_description = 'Файл профиля'
+
+    def sql_table(self, obj):
+        rows = format_html_join(
+            '', '<tr><td>{}</td><td>{}</td><td><code>{}</code></td></tr>',
+            ((query['time_ms'], query['origin'], query['sql']) for query in obj.sql_queries)
+        )
+        return format_html(
+            '<table><thead><tr><th>мс</th><th>Откуда</th><th>SQL</th></tr></thead><tbody>{}</tbody></table>',
+            rows
+        )
+
+    sql_table.short_description = 'SQL-запросы'
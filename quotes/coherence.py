@@ -0,0 +1,174 @@
+"""Согласование кэшей в памяти между рабочими процессами.
+
+Каждый процесс gunicorn/uWSGI держит свои копии данных (веса для случайного
+выбора, популярные цитаты). Чтобы процессы узнавали об изменениях, в файле,
+отображенном в память (mmap), хранится счетчик поколения для каждого домена.
+Запись в базу увеличивает счетчик своего домена (bump), а читатель сравнивает
+его со своим одним чтением из памяти и перезагружает данные, только если
+поколение сменилось. Файл общий для процессов одной машины.
+"""
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: без межпроцессной блокировки одновременные bump могут слиться в один,
+    # но поколение все равно сменится
+    fcntl = None
+
+
+logger = logging.getLogger(__name__)
+
+CATALOG = 'catalog'
+STATS = 'stats'
+LEADERBOARDS = 'leaderboards'
+
+# Номер ячейки каждого домена в файле. Новые домены добавляются в конец
+DOMAINS = (CATALOG, STATS, LEADERBOARDS)
+
+# Ячеек с запасом, чтобы новые домены не меняли размер файла
+SLOTS = 16
+SLOT = struct.Struct('<Q')
+
+
+class GenerationTable:
+    """Счетчики поколений в файле, отображенном в память"""
+
+    def __init__(self, path):
+        self.path = path
+        self._buffer = None
+        self._fd = None
+        self._pid = None
+        self._open_lock = threading.Lock()
+
+    def _map(self):
+        # После fork файл открывается заново: flock на унаследованном дескрипторе
+        # не разделяет родителя и потомков
+        if self._pid != os.getpid():
+            with self._open_lock:
+                if self._pid != os.getpid():
+                    self._close()
+                    self._buffer = self._open()
+                    self._pid = os.getpid()
+        return self._buffer
+
+    def _close(self):
+        # Унаследованные от родителя отображение и дескриптор закрываются только в этом процессе
+        if isinstance(self._buffer, mmap.mmap):
+            self._buffer.close()
+        if self._fd is not None:
+            os.close(self._fd)
+        self._buffer = None
+        self._fd = None
+
+    def _open(self):
+        size = SLOTS * SLOT.size
+        try:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            buffer = mmap.mmap(fd, size)
+        except (OSError, ValueError):
+            # Например, каталог недоступен для записи: поколения будут только внутри процесса
+            logger.warning('Файл поколений %s недоступен, кэши не согласуются между процессами',
+                           self.path, exc_info=True)
+            return bytearray(size)
+        self._fd = fd
+        return buffer
+
+    def get(self, domain):
+        return SLOT.unpack_from(self._map(), DOMAINS.index(domain) * SLOT.size)[0]
+
+    def increment(self, domain):
+        buffer = self._map()
+        offset = DOMAINS.index(domain) * SLOT.size
+        if fcntl is not None and self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            value = SLOT.unpack_from(buffer, offset)[0] + 1
+            SLOT.pack_into(buffer, offset, value)
+        finally:
+            if fcntl is not None and self._fd is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        return value
+
+
+table = GenerationTable(settings.QUOTES_COHERENCE_FILE)
+
+
+def generation(domain):
+    """Текущее поколение домена (одно чтение из общей памяти)"""
+    return table.get(domain)
+
+
+def bump(*domains):
+    """Отмечает изменение данных доменов.
+
+    Внутри транзакции поколение увеличивается еще раз после фиксации: процесс,
+    успевший перечитать данные до фиксации, получил старые данные и должен
+    перечитать их снова.
+    """
+    _increment(domains)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: _increment(domains))
+
+
+def _increment(domains):
+    for domain in domains:
+        table.increment(domain)
+
+
+class CoherentValue:
+    """Значение в памяти процесса, которое перезагружается при смене поколения.
+
+    Перезагрузка выполняется одним потоком процесса; остальные в это время
+    получают прежнее значение (или ждут, если значения еще нет). ttl задает
+    наибольший возраст значения для изменений, о которых bump не сообщает.
+    """
+
+    def __init__(self, domains, loader, ttl=None):
+        self.domains = tuple(domains)
+        self.loader = loader
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # (значение, поколения, время загрузки) заменяется целиком
+        self._state = None
+
+    def _generations(self):
+        return tuple(generation(domain) for domain in self.domains)
+
+    def _is_fresh(self, state, generations):
+        return (
+            state is not None and state[1] == generations
+            and (self.ttl is None or time.monotonic() - state[2] < self.ttl)
+        )
+
+    def get(self):
+        state = self._state
+        if self._is_fresh(state, self._generations()):
+            return state[0]
+
+        if not self._lock.acquire(blocking=state is None):
+            return state[0]
+        try:
+            # Поколения читаются до загрузки: изменение во время загрузки вызовет новую
+            generations = self._generations()
+            state = self._state
+            if not self._is_fresh(state, generations):
+                state = (self.loader(), generations, time.monotonic())
+                self._state = state
+            return state[0]
+        finally:
+            self._lock.release()
+
+    def invalidate(self):
+        """Сбрасывает значение только в этом процессе"""
+        self._state = None
@@ -0,0 +1,213 @@
+"""Счетчики просмотров и голосов с шардированием для популярных цитат.
+
+Обычно счетчик увеличивается одним UPDATE ... SET likes = likes + 1 по строке
+цитаты. Когда за минуту на цитату приходит больше QUOTES_HOT_VOTES_PER_MINUTE
+голосов, она переключается в шардированный режим: запись идет в случайную из
+QUOTES_COUNTER_SHARDS строк QuoteCounterShard, а чтение добавляет к значениям
+цитаты кэшированную сумму шардов. compact() переносит накопленное обратно в Quote.
+"""
+import random
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef, Sum
+from django.db.models.functions import Coalesce
+
+from . import tasks
+from .models import Quote, QuoteCounterShard
+
+
+COUNTER_FIELDS = ('views', 'likes', 'dislikes')
+VOTE_FIELDS = ('likes', 'dislikes')
+
+# Сколько секунд кэшируется сумма шардов цитаты
+SHARD_TOTALS_TTL = 2
+
+# Через сколько секунд после голоса в шард переносить накопленное в цитату
+COMPACT_DELAY = 30
+
+
+def _totals_key(quote_id, field):
+    return f'quotes:shard-totals:{quote_id}:{field}'
+
+
+def _is_hot(quote_id):
+    """Учитывает голос и проверяет, превышен ли порог голосов в минуту"""
+    key = f'quotes:vote-rate:{quote_id}:{int(time.time() // 60)}'
+    cache.add(key, 0, timeout=120)
+    try:
+        votes = cache.incr(key)
+    except ValueError:
+        # Ключ успел истечь между add и incr
+        return False
+    return votes >= settings.QUOTES_HOT_VOTES_PER_MINUTE
+
+
+def _still_hot(quote_id):
+    key = f'quotes:vote-rate:{quote_id}:{int(time.time() // 60)}'
+    return (cache.get(key) or 0) >= settings.QUOTES_HOT_VOTES_PER_MINUTE
+
+
+def increment(quote, field):
+    """Увеличивает счетчик field цитаты на 1 без чтения и сохранения всей строки"""
+    if field not in COUNTER_FIELDS:
+        raise ValueError(f'Неизвестный счетчик: {field}')
+
+    if field in VOTE_FIELDS and not quote.sharded_counters and _is_hot(quote.pk):
+        Quote.objects.filter(pk=quote.pk).update(sharded_counters=True)
+        quote.sharded_counters = True
+
+    if not quote.sharded_counters:
+        Quote.objects.filter(pk=quote.pk).update(**{field: F(field) + 1})
+        setattr(quote, field, getattr(quote, field) + 1)
+        return
+
+    _add_to_shard(quote.pk, {field: 1})
+
+
+def increment_many(deltas):
+    """Прибавляет голоса пакета к цитатам со счетчиками в шардах.
+
+    deltas - словарь {quote_id: {поле: приращение}}; каждая цитата получает
+    свои приращения одним UPDATE случайного шарда.
+    """
+    for quote_id, changes in deltas.items():
+        if any(field not in COUNTER_FIELDS for field in changes):
+            raise ValueError(f'Неизвестный счетчик: {set(changes) - set(COUNTER_FIELDS)}')
+        _add_to_shard(quote_id, changes)
+
+
+def _add_to_shard(quote_id, changes):
+    shard = random.randrange(settings.QUOTES_COUNTER_SHARDS)
+    shards = QuoteCounterShard.objects.filter(quote_id=quote_id, shard=shard)
+    update = {field: F(field) + n for field, n in changes.items()}
+    if not shards.update(**update):
+        # Первая запись после включения или после сжатия: создаем все шарды сразу
+        QuoteCounterShard.objects.bulk_create(
+            [QuoteCounterShard(quote_id=quote_id, shard=i) for i in range(settings.QUOTES_COUNTER_SHARDS)],
+            ignore_conflicts=True,
+        )
+        Quote.objects.filter(pk=quote_id).update(sharded_counters=True)
+        shards.update(**update)
+
+    # Учитываем свои голоса в закэшированной сумме (incr не продлевает срок жизни ключа)
+    for field, n in changes.items():
+        try:
+            cache.incr(_totals_key(quote_id, field), n)
+        except ValueError:
+            pass
+
+    # Сжатие ставится в очередь не чаще раза в COMPACT_DELAY секунд на цитату. Без
+    # фонового обработчика шарды сжимает команда compact_counters по расписанию:
+    # сжатие на месте сразу отменило бы шардирование
+    if not settings.QUOTES_TASKS_SYNC and cache.add(f'quotes:compact-scheduled:{quote_id}', 1, timeout=COMPACT_DELAY):
+        tasks.enqueue('compact_counters', {'quote_id': quote_id}, dedupe_key=str(quote_id), delay=COMPACT_DELAY)
+
+
+def shard_totals(quote_ids):
+    """Суммы шардов для цитат: {quote_id: {'views': .., 'likes': .., 'dislikes': ..}}.
+
+    Суммы берутся из кэша, для остальных цитат считаются одним запросом.
+    """
+    keys = {
+        _totals_key(quote_id, field): (quote_id, field)
+        for quote_id in quote_ids for field in COUNTER_FIELDS
+    }
+    cached = cache.get_many(keys)
+    totals = {quote_id: {} for quote_id in quote_ids}
+    for key, value in cached.items():
+        quote_id, field = keys[key]
+        totals[quote_id][field] = value
+
+    missing = [quote_id for quote_id, values in totals.items() if len(values) < len(COUNTER_FIELDS)]
+    if missing:
+        rows = QuoteCounterShard.objects.filter(quote_id__in=missing).values('quote_id').annotate(
+            **{field: Coalesce(Sum(field), 0) for field in COUNTER_FIELDS}
+        )
+        fresh = {quote_id: dict.fromkeys(COUNTER_FIELDS, 0) for quote_id in missing}
+        for row in rows:
+            fresh[row.pop('quote_id')] = row
+        cache.set_many({
+            _totals_key(quote_id, field): value
+            for quote_id, values in fresh.items() for field, value in values.items()
+        }, SHARD_TOTALS_TTL)
+        totals.update(fresh)
+    return totals
+
+
+def get_counts(quote):
+    """Текущие значения счетчиков цитаты с учетом шардов"""
+    counts = {field: getattr(quote, field) for field in COUNTER_FIELDS}
+    if quote.sharded_counters:
+        for field, value in shard_totals([quote.pk])[quote.pk].items():
+            counts[field] += value
+    return counts
+
+
+def apply_counts(quote):
+    """Подставляет в цитату значения счетчиков с учетом шардов (для вывода)"""
+    for field, value in get_counts(quote).items():
+        setattr(quote, field, value)
+    return quote
+
+
+def apply_counts_many(quotes):
+    """Как apply_counts, но для списка цитат: суммы шардов берутся одним запросом"""
+    sharded = [quote for quote in quotes if quote.sharded_counters]
+    if sharded:
+        totals = shard_totals([quote.pk for quote in sharded])
+        for quote in sharded:
+            for field, value in totals[quote.pk].items():
+                setattr(quote, field, getattr(quote, field) + value)
+    return quotes
+
+
+def compact(quote_ids=None):
+    """Переносит накопленное в шардах в Quote.
+
+    Из шардов вычитается ровно прочитанное, поэтому голоса, пришедшие во время
+    сжатия, не теряются. Если цитата больше не горячая, пустые шарды удаляются
+    и она возвращается к обычным счетчикам. Частота голосов берется из кэша,
+    поэтому для сжатия из отдельного процесса нужен общий кэш (memcached, Redis).
+    Возвращает число обработанных цитат.
+    """
+    quotes = Quote.objects.filter(sharded_counters=True)
+    if quote_ids is not None:
+        quotes = quotes.filter(pk__in=quote_ids)
+
+    compacted = 0
+    for quote_id in list(quotes.values_list('pk', flat=True)):
+        with transaction.atomic():
+            shards = list(
+                QuoteCounterShard.objects.select_for_update().filter(quote_id=quote_id).values('pk', *COUNTER_FIELDS)
+            )
+            totals = {field: sum(shard[field] for shard in shards) for field in COUNTER_FIELDS}
+            if any(totals.values()):
+                Quote.objects.filter(pk=quote_id).update(
+                    **{field: F(field) + value for field, value in totals.items()}
+                )
+                for shard in shards:
+                    if any(shard[field] for field in COUNTER_FIELDS):
+                        QuoteCounterShard.objects.filter(pk=shard['pk']).update(
+                            **{field: F(field) - shard[field] for field in COUNTER_FIELDS}
+                        )
+
+            if not _still_hot(quote_id):
+                QuoteCounterShard.objects.filter(quote_id=quote_id, views=0, likes=0, dislikes=0).delete()
+                # Флаг снимается, только если шардов не осталось (их могли создать заново)
+                Quote.objects.filter(pk=quote_id).exclude(
+                    Exists(QuoteCounterShard.objects.filter(quote_id=OuterRef('pk')))
+                ).update(sharded_counters=False)
+        cache.delete_many([_totals_key(quote_id, field) for field in COUNTER_FIELDS])
+        compacted += 1
+    return compacted
+
+
+def reset(quotes):
+    """Обнуляет счетчики цитат вместе с их шардами"""
+    with transaction.atomic():
+        QuoteCounterShard.objects.filter(quote__in=quotes).delete()
+        updated = quotes.update(views=0, likes=0, dislikes=0, sharded_counters=False)
+    return updated
@@ -0,0 +1,186 @@
+"""Генерация больших синтетических каталогов цитат для нагрузочных тестов.
+
+Каталог детерминирован: при одинаковых параметрах и seed на пустой базе
+получаются одинаковые данные. Веса и счетчики распределены по закону Ципфа,
+как в реальном каталоге (немногие цитаты очень популярны, большинство - нет).
+"""
+import itertools
+from contextlib import contextmanager
+from datetime import timezone as dt_timezone
+
+import numpy as np
+from django.conf import settings
+from django.core.management.color import no_style
+from django.db import connections, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import Quote, Source, SourceType, MAX_QUOTES_PER_SOURCE, invalidate_sampling, invalidate_stats, normalize_title
+
+
+WORDS = (
+    'жизнь', 'время', 'никогда', 'всегда', 'сила', 'мир', 'друг', 'путь', 'правда',
+    'сердце', 'судьба', 'выбор', 'надежда', 'страх', 'свобода', 'сегодня', 'завтра',
+    'смелость', 'тьма', 'свет', 'память', 'мечта', 'дорога', 'война', 'любовь',
+)
+
+
+# Кэш страниц SQLite на время генерации, КиБ
+SQLITE_CACHE_KIB = 256 * 1024
+
+
+class ZipfSampler:
+    """Выбор целых чисел из [1, n] с вероятностью, пропорциональной 1 / k**s"""
+
+    def __init__(self, n, s, rng):
+        self.rng = rng
+        self.cumulative = np.cumsum(1.0 / np.arange(1, n + 1) ** s)
+
+    def __call__(self, size):
+        """Массив из size случайных чисел"""
+        points = self.rng.random(size) * self.cumulative[-1]
+        return np.searchsorted(self.cumulative, points) + 1
+
+
+def generate_catalog(sources_per_type=100, quotes_per_source=MAX_QUOTES_PER_SOURCE, seed=42,
+                     zipf_exponent=1.1, max_weight=100, max_votes=10000, created_within_days=365,
+                     batch_size=5000, using='default'):
+    """Создает источники каждого типа и цитаты к ним одной транзакцией.
+
+    Значения каждой пачки строятся по столбцам средствами NumPy, а не по строкам.
+    На SQLite скорость около 50 тыс. строк/с (300 тыс. цитат и 100 тыс. источников)
+    и около 40 тыс. строк/с на 4 млн строк; почти все время уходит на обновление
+    индексов цитат внутри executemany. Возвращает словарь с количеством созданных
+    источников и цитат.
+    """
+    if not 1 <= quotes_per_source <= MAX_QUOTES_PER_SOURCE:
+        raise ValueError(f'quotes_per_source должно быть от 1 до {MAX_QUOTES_PER_SOURCE}')
+
+    rng = np.random.default_rng(seed)
+    # Готовый набор фраз: собирать текст из слов для каждой строки слишком дорого
+    phrases = [' '.join(rng.choice(WORDS, size=rng.integers(5, 21))) for _ in range(1000)]
+    weight = ZipfSampler(max_weight, zipf_exponent, rng)
+    votes = ZipfSampler(max_votes, zipf_exponent, rng)
+    connection = connections[using]
+    now = timezone.now()
+    max_age = created_within_days * 86400
+    sources_per_batch = max(batch_size // quotes_per_source, 1)
+
+    with transaction.atomic(using=using), _large_sqlite_cache(connection):
+        # id назначаются заранее, чтобы связать цитаты с источниками без повторного чтения
+        source_id = (Source.objects.using(using).aggregate(n=Max('id'))['n'] or 0) + 1
+        quote_id = (Quote.objects.using(using).aggregate(n=Max('id'))['n'] or 0) + 1
+        source_count = quote_count = 0
+
+        for source_type in SourceType:
+            for start in range(0, sources_per_type, sources_per_batch):
+                sources = min(sources_per_batch, sources_per_type - start)
+                quotes = sources * quotes_per_source
+                source_ids = np.arange(source_id, source_id + sources)
+                quote_ids = np.arange(quote_id, quote_id + quotes)
+
+                titles = [f'{source_type.label} №{i}' for i in source_ids.tolist()]
+                insert_columns(Source, {
+                    'id': source_ids.tolist(),
+                    'title': titles,
+                    'normalized_title': [normalize_title(title) for title in titles],
+                    'type': itertools.repeat(source_type.value, sources),
+                    'quote_count': itertools.repeat(quotes_per_source, sources),
+                }, using)
+
+                likes = votes(quotes) - 1
+                dislikes = votes(quotes) - 1
+                insert_columns(Quote, {
+                    'id': quote_ids.tolist(),
+                    # Номер с ведущими нулями: тексты идут по возрастанию, и уникальный
+                    # индекс (text, source) заполняется последовательно
+                    'text': [
+                        f'Цитата {i:010d}: {phrases[p]}'
+                        for i, p in zip(quote_ids.tolist(), rng.integers(1000, size=quotes).tolist())
+                    ],
+                    'source_id': np.repeat(source_ids, quotes_per_source).tolist(),
+                    'weight': weight(quotes).tolist(),
+                    'views': (likes + dislikes + votes(quotes) - 1).tolist(),
+                    'likes': likes.tolist(),
+                    'dislikes': dislikes.tolist(),
+                    'created_at': _datetime_column(now, rng.integers(max_age, size=quotes), connection),
+                }, using)
+
+                source_id += sources
+                quote_id += quotes
+                source_count += sources
+                quote_count += quotes
+
+        # Явные id не двигают последовательности (PostgreSQL), сбрасываем их
+        sequence_sql = connection.ops.sequence_reset_sql(no_style(), [Source, Quote])
+        if sequence_sql:
+            with connection.cursor() as cursor:
+                for sql in sequence_sql:
+                    cursor.execute(sql)
+
+    invalidate_sampling()
+    invalidate_stats()
+    return {'sources': source_count, 'quotes': quote_count}
+
+
+@contextmanager
+def _large_sqlite_cache(connection):
+    """Увеличивает кэш страниц SQLite на время генерации.
+
+    Индексы цитат со случайным порядком ключей (популярность, дата) уже на сотнях
+    тысяч строк не помещаются в стандартные 2 МБ, и вставка упирается в чтение
+    страниц индексов. Память выделяется по мере надобности, не больше SQLITE_CACHE_KIB.
+    """
+    if connection.vendor != 'sqlite':
+        yield
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA cache_size')
+        previous = cursor.fetchone()[0]
+        cursor.execute(f'PRAGMA cache_size = -{SQLITE_CACHE_KIB}')
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA cache_size = {int(previous)}')
+
+
+def _datetime_column(now, ages, connection):
+    """Значения DateTimeField для now минус ages секунд, подготовленные для базы.
+
+    Строки форматируются одним вызовом NumPy вместо adapt_datetimefield_value
+    на каждое значение: 'ГГГГ-ММ-ДД ЧЧ:ММ:СС.мкс', как str(datetime), который
+    Django записывает в SQLite и MySQL. PostgreSQL при USE_TZ получает явный пояс UTC.
+    """
+    if settings.USE_TZ:
+        now = timezone.make_naive(now, dt_timezone.utc)
+    stamps = np.datetime64(now, 'us') - ages.astype('timedelta64[s]')
+    values = np.char.replace(np.datetime_as_string(stamps, unit='us'), 'T', ' ')
+    if settings.USE_TZ and connection.vendor == 'postgresql':
+        values = np.char.add(values, '+00:00')
+    return values.tolist()
+
+
+def insert_columns(model, columns, using='default'):
+    """Многострочная вставка готовых значений через executemany.
+
+    columns - словарь {attname: значения столбца}; строки для executemany
+    собираются zip() по столбцам. В отличие от bulk_create не создает экземпляры
+    моделей и не перезаписывает created_at (auto_now_add). Значения должны быть
+    уже подготовлены для базы; поля модели, которых нет в columns, получают
+    значения по умолчанию.
+    """
+    connection = connections[using]
+    quote_name = connection.ops.quote_name
+    fields = [model._meta.get_field(attname) for attname in columns]
+    missing = [f for f in model._meta.concrete_fields if f.attname not in columns]
+    # zip() останавливается на самом коротком столбце, поэтому значения по умолчанию бесконечны
+    values = [*columns.values(), *(itertools.repeat(f.get_db_prep_save(f.get_default(), connection)) for f in missing)]
+
+    sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+        quote_name(model._meta.db_table),
+        ', '.join(quote_name(f.column) for f in fields + missing),
+        ', '.join(['%s'] * (len(fields) + len(missing))),
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, zip(*values))
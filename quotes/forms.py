@@ -1,5 +1,53 @@
 from django import forms
-from .models import Quote, Source, SourceType
+from django.urls import reverse
+from .models import Quote, Source, SourceType, MAX_ID, MAX_QUOTES_PER_SOURCE, normalize_title
+
+
+def _source_id(value):
+    """id источника из отправленного значения или None, если это не id из диапазона ключей"""
+    try:
+        source_id = int(value)
+    except (TypeError, ValueError):
+        return None
+    # Больший id переполнил бы целое в запросе к базе
+    return source_id if 0 < source_id <= MAX_ID else None
+
+
+class SourceAutocompleteWidget(forms.Widget):
+    """Поле выбора источника с автодополнением.
+
+    В отличие от Select не выводит все источники в HTML: варианты подгружаются
+    с эндпоинта автодополнения, а в форму отправляется только id.
+    """
+    template_name = 'quotes/widgets/source_autocomplete.html'
+
+    class Media:
+        js = ['quotes/js/source_autocomplete.js']
+
+    def id_for_label(self, id_):
+        # Подпись поля относится к видимому полю поиска
+        return f'{id_}_search' if id_ else id_
+
+    def get_context(self, name, value, attrs):
+        context = super().get_context(name, value, attrs)
+        context['widget']['url'] = reverse('source_autocomplete')
+        # Название выбранного источника нужно, чтобы показать его при повторном выводе формы
+        label = ''
+        source_id = _source_id(value) if value else None
+        if source_id:
+            source = Source.objects.filter(pk=source_id).first()
+            label = str(source) if source else ''
+        context['widget']['label'] = label
+        return context
+
+
+class SourceChoiceField(forms.ModelChoiceField):
+    """Выбор источника по id: неверный id - ошибка формы, а не ошибка базы"""
+
+    def to_python(self, value):
+        if value not in self.empty_values and _source_id(value) is None:
+            raise forms.ValidationError(self.error_messages['invalid_choice'], code='invalid_choice')
+        return super().to_python(value)
 
 
 class QuoteForm(forms.ModelForm):
@@ -20,6 +68,9 @@ class QuoteForm(forms.ModelForm):
     class Meta:
         model = Quote
         fields = ['text', 'source', 'weight']
+        field_classes = {
+            'source': SourceChoiceField,
+        }
         labels = {
             'text': 'Текст цитаты',
             'source': 'Выберите источник',
@@ -30,19 +81,18 @@ class QuoteForm(forms.ModelForm):
         }
         widgets = {
             'text': forms.Textarea(attrs={'rows': 4, 'class': 'form-control'}),
-            'source': forms.Select(attrs={'class': 'form-control'}),
+            'source': SourceAutocompleteWidget(attrs={'class': 'form-control'}),
             'weight': forms.NumberInput(attrs={'class': 'form-control', 'min': 1}),
         }
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        # Ограничиваем выбор только теми источниками, у которых меньше 3 цитат
-        self.fields['source'].queryset = Source.objects.filter(quote_count__lt=3)
+        # Ограничиваем выбор только теми источниками, у которых меньше 3 цитат.
+        # Список целиком не выводится, проверяется только отправленный id
+        self.fields['source'].queryset = Source.objects.filter(quote_count__lt=MAX_QUOTES_PER_SOURCE)
 
-        # Если нет источников с доступными местами, скрываем поле выбора
-        if not self.fields['source'].queryset.exists():
-            self.fields['source'].widget = forms.HiddenInput()
-            self.fields['source'].required = False
+        # Источник можно не выбирать, если указаны данные для нового
+        self.fields['source'].required = False
 
     def clean(self):
         cleaned_data = super().clean()
@@ -68,7 +118,7 @@ class QuoteForm(forms.ModelForm):
         # Если указаны данные для нового источника, проверяем их
         if new_source_title and new_source_type:
             # Проверяем, не существует ли уже источник с таким названием
-            if Source.objects.filter(title__iexact=new_source_title.strip()).exists():
+            if Source.objects.filter(normalized_title=normalize_title(new_source_title)).exists():
                 raise forms.ValidationError(
                     f'Источник "{new_source_title}" уже существует. Выберите его из списка.'
                 )
@@ -0,0 +1,79 @@
+"""Списки популярных цитат для страницы "Популярные".
+
+Списки хранятся в памяти процесса и перечитываются, когда меняется каталог
+или приходят голоса (поколения CATALOG и LEADERBOARDS в coherence), но не
+чаще, чем запрашивается страница. Просмотры не меняют поколение, поэтому
+список самых просматриваемых обновляется по LEADERBOARDS_TTL.
+
+Голоса не перестраивают списки сразу: votes_changed() ставит в очередь задачу
+refresh_aggregates (одну на REFRESH_DELAY секунд), и процессы перечитывают
+списки один раз на окно, а не после каждого голоса.
+
+Голоса горячих цитат частично лежат в шардах (см. counters), поэтому к
+кандидатам из индекса добавляются все цитаты со счетчиками в шардах, а
+сортировка выполняется после прибавления сумм шардов.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+
+from . import coherence, counters, tasks
+from .models import Quote
+
+
+LEADERBOARDS_TTL = 30
+
+# Голоса за это время схлопываются в один пересчет популярных и статистики
+REFRESH_DELAY = 10
+
+
+def _merge(quotes, sharded, key, limit):
+    """Первые limit цитат по key среди выбранных по индексу и цитат со счетчиками в шардах"""
+    merged = {quote.pk: quote for quote in quotes if not quote.sharded_counters}
+    merged.update((quote.pk, quote) for quote in sharded)
+    return sorted(merged.values(), key=key, reverse=True)[:limit]
+
+
+def load_leaderboards():
+    # Только активные цитаты: запросы идут по частичным индексам
+    quotes = Quote.objects.active().select_related('source')
+    # Горячих цитат со счетчиками в шардах немного, их добавляем к кандидатам всегда
+    sharded = list(quotes.filter(sharded_counters=True))
+    counters.apply_counts_many(sharded)
+
+    top_quotes = list(quotes.order_by(
+        (F('likes') - F('dislikes')).desc(), F('created_at').desc()
+    )[:10])
+    most_viewed = list(quotes.order_by('-views')[:5])
+    recent_quotes = counters.apply_counts_many(list(quotes.order_by('-created_at')[:5]))
+    return {
+        'top_quotes': _merge(top_quotes, sharded, lambda q: (q.likes - q.dislikes, q.created_at), 10),
+        'most_viewed': _merge(most_viewed, sharded, lambda q: q.views, 5),
+        'recent_quotes': recent_quotes,
+    }
+
+
+leaderboards = coherence.CoherentValue(
+    (coherence.CATALOG, coherence.LEADERBOARDS), load_leaderboards, ttl=LEADERBOARDS_TTL
+)
+
+
+def get_leaderboards():
+    return leaderboards.get()
+
+
+def invalidate():
+    """Сообщает всем процессам, что рейтинги цитат изменились"""
+    coherence.bump(coherence.LEADERBOARDS)
+
+
+def votes_changed():
+    """Откладывает пересчет рейтингов после голосов.
+
+    Без фонового обработчика (QUOTES_TASKS_SYNC) только сообщает процессам об
+    изменении: пересчитывать статистику на каждый голос слишком дорого.
+    """
+    if settings.QUOTES_TASKS_SYNC:
+        invalidate()
+    elif cache.add('quotes:aggregates-scheduled', 1, timeout=REFRESH_DELAY):
+        tasks.enqueue('refresh_aggregates', dedupe_key='votes', delay=REFRESH_DELAY)
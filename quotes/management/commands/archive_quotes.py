@@ -0,0 +1,46 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from quotes.models import Quote
+
+
+class Command(BaseCommand):
+    help = 'Переносит в архив старые цитаты с низким рейтингом (пачками, для запуска по расписанию)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=int, default=180,
+                            help='Архивировать цитаты, добавленные раньше, чем N дней назад')
+        parser.add_argument('--max-score', type=int, default=0,
+                            help='Максимальный рейтинг (лайки минус дизлайки) архивируемой цитаты')
+        parser.add_argument('--max-views', type=int, default=None,
+                            help='Архивировать только цитаты не больше чем с N просмотрами')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Размер пачки')
+        parser.add_argument('--pause', type=float, default=0,
+                            help='Пауза между пачками в секундах, чтобы не мешать запросам')
+        parser.add_argument('--dry-run', action='store_true', help='Только посчитать кандидатов')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['older_than_days'])
+        candidates = Quote.objects.active().stale(
+            cutoff, max_score=options['max_score'], max_views=options['max_views'],
+        ).order_by('id')
+
+        archived = last_id = 0
+        while True:
+            # Переход по id: каждая пачка - короткая транзакция без OFFSET
+            ids = list(candidates.filter(id__gt=last_id).values_list('id', flat=True)[:options['batch_size']])
+            if not ids:
+                break
+            last_id = ids[-1]
+            if options['dry_run']:
+                archived += len(ids)
+            else:
+                archived += Quote.objects.filter(pk__in=ids).archive()
+                if options['pause']:
+                    time.sleep(options['pause'])
+
+        verb = 'Будет архивировано' if options['dry_run'] else 'Архивировано'
+        self.stdout.write(f'{verb} цитат: {archived}')
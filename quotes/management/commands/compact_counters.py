@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from quotes import counters
+
+
+class Command(BaseCommand):
+    help = 'Переносит голоса и просмотры из шардов счетчиков в цитаты'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--quote-id', type=int, action='append', dest='quote_ids',
+                            help='Сжать только указанные цитаты (можно повторять)')
+        parser.add_argument('--interval', type=float, default=0,
+                            help='Повторять каждые N секунд (0 - выполнить один раз)')
+
+    def handle(self, *args, **options):
+        while True:
+            compacted = counters.compact(options['quote_ids'])
+            self.stdout.write(f'Сжато цитат: {compacted}')
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,58 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from quotes.datagen import generate_catalog
+from quotes.models import Quote, QuoteCounterShard, Source, MAX_QUOTES_PER_SOURCE
+
+
+class Command(BaseCommand):
+    help = 'Генерирует детерминированный синтетический каталог цитат для нагрузочного тестирования'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sources-per-type', type=int, default=1000,
+                            help='Количество источников каждого типа')
+        parser.add_argument('--quotes-per-source', type=int, default=MAX_QUOTES_PER_SOURCE,
+                            help=f'Количество цитат у источника (от 1 до {MAX_QUOTES_PER_SOURCE})')
+        parser.add_argument('--seed', type=int, default=42, help='Seed генератора случайных чисел')
+        parser.add_argument('--zipf-exponent', type=float, default=1.1,
+                            help='Показатель распределения Ципфа для весов и голосов')
+        parser.add_argument('--max-weight', type=int, default=100, help='Максимальный вес цитаты')
+        parser.add_argument('--max-votes', type=int, default=10000,
+                            help='Максимальное количество лайков/дизлайков у цитаты')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Размер пакета вставки')
+        parser.add_argument('--clear', action='store_true', help='Удалить все цитаты и источники перед генерацией')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='Алиас базы данных')
+
+    def handle(self, *args, **options):
+        if not 1 <= options['quotes_per_source'] <= MAX_QUOTES_PER_SOURCE:
+            raise CommandError(f'--quotes-per-source должно быть от 1 до {MAX_QUOTES_PER_SOURCE}')
+
+        using = options['database']
+        if options['clear']:
+            # Без пересчета счетчиков источников (источники удаляются следом) и без
+            # обхода связей: зависимые таблицы очищаются первыми, все вместе или ничего
+            with transaction.atomic(using=using):
+                QuoteCounterShard.objects.using(using).all()._raw_delete(using)
+                Quote.objects.using(using).all()._raw_delete(using)
+                Source.objects.using(using).all()._raw_delete(using)
+
+        started = time.perf_counter()
+        created = generate_catalog(
+            sources_per_type=options['sources_per_type'],
+            quotes_per_source=options['quotes_per_source'],
+            seed=options['seed'],
+            zipf_exponent=options['zipf_exponent'],
+            max_weight=options['max_weight'],
+            max_votes=options['max_votes'],
+            batch_size=options['batch_size'],
+            using=using,
+        )
+        elapsed = time.perf_counter() - started
+
+        rows = created['sources'] + created['quotes']
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано источников: {created["sources"]}, цитат: {created["quotes"]} '
+            f'за {elapsed:.2f} с ({rows / elapsed:,.0f} строк/с)'
+        ))
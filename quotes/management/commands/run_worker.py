@@ -0,0 +1,34 @@
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+
+from quotes import tasks
+
+
+class Command(BaseCommand):
+    help = 'Выполняет отложенные задачи из очереди (см. quotes.tasks)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Сколько задач забирать за раз')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Пауза в секундах, когда очередь пуста')
+        parser.add_argument('--once', action='store_true',
+                            help='Выполнить готовые задачи и завершиться')
+
+    def handle(self, *args, **options):
+        worker_id = uuid.uuid4().hex
+        processed = 0
+        try:
+            while True:
+                claimed = tasks.run_pending(options['batch_size'], worker_id)
+                processed += claimed
+                if claimed:
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(f'Обработано задач: {processed}')
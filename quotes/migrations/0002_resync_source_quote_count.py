@@ -0,0 +1,24 @@
+from django.db import migrations
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def resync_quote_count(apps, schema_editor):
+    # Раньше удаление цитат не уменьшало счетчик, поэтому пересчитываем его по факту
+    Source = apps.get_model('quotes', 'Source')
+    Quote = apps.get_model('quotes', 'Quote')
+    actual = Quote.objects.filter(source=OuterRef('pk')).order_by().values('source').annotate(
+        n=Count('id')
+    ).values('n')
+    Source.objects.update(quote_count=Coalesce(Subquery(actual), Value(0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quotes', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(resync_quote_count, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+from django.db import migrations, models
+
+
+def fill_normalized_title(apps, schema_editor):
+    Source = apps.get_model('quotes', 'Source')
+    sources = list(Source.objects.only('id', 'title'))
+    for source in sources:
+        source.normalized_title = ' '.join(source.title.split()).casefold()
+    Source.objects.bulk_update(sources, ['normalized_title'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quotes', '0002_resync_source_quote_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='source',
+            name='normalized_title',
+            field=models.CharField(default='', editable=False, max_length=200),
+        ),
+        migrations.RunPython(fill_normalized_title, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='source',
+            index=models.Index(fields=['normalized_title', 'quote_count'], name='source_title_prefix_idx'),
+        ),
+    ]
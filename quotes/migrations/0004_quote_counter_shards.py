@@ -0,0 +1,35 @@
+# Generated by Django 4.2.23 on 2026-10-19 17:36
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quotes', '0003_source_normalized_title'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='quote',
+            name='sharded_counters',
+            field=models.BooleanField(default=False, editable=False, verbose_name='Счетчики в шардах'),
+        ),
+        migrations.CreateModel(
+            name='QuoteCounterShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.PositiveSmallIntegerField(verbose_name='Номер шарда')),
+                ('views', models.PositiveIntegerField(default=0, verbose_name='Просмотры')),
+                ('likes', models.PositiveIntegerField(default=0, verbose_name='Лайки')),
+                ('dislikes', models.PositiveIntegerField(default=0, verbose_name='Дизлайки')),
+                ('quote', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='counter_shards', to='quotes.quote', verbose_name='Цитата')),
+            ],
+            options={
+                'verbose_name': 'Шард счетчиков',
+                'verbose_name_plural': 'Шарды счетчиков',
+                'unique_together': {('quote', 'shard')},
+            },
+        ),
+    ]
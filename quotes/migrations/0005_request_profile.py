@@ -0,0 +1,35 @@
+# Generated by Django 4.2.23 on 2026-10-19 17:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quotes', '0004_quote_counter_shards'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RequestProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Дата')),
+                ('method', models.CharField(max_length=10, verbose_name='Метод')),
+                ('path', models.CharField(max_length=500, verbose_name='Адрес')),
+                ('view_name', models.CharField(blank=True, max_length=200, verbose_name='Представление')),
+                ('status_code', models.PositiveSmallIntegerField(verbose_name='Код ответа')),
+                ('mode', models.CharField(choices=[('cprofile', 'cProfile (pstats)'), ('sample', 'Семплирование стеков (flamegraph)')], max_length=10, verbose_name='Режим')),
+                ('duration_ms', models.FloatField(verbose_name='Время, мс')),
+                ('sql_count', models.PositiveIntegerField(default=0, verbose_name='SQL-запросов')),
+                ('sql_time_ms', models.FloatField(default=0, verbose_name='Время SQL, мс')),
+                ('sql_queries', models.JSONField(default=list, verbose_name='SQL-запросы')),
+                ('data', models.BinaryField(verbose_name='Данные профиля')),
+            ],
+            options={
+                'verbose_name': 'Профиль запроса',
+                'verbose_name_plural': 'Профили запросов',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
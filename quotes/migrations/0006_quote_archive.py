@@ -0,0 +1,40 @@
+# Generated by Django 4.2.23 on 2026-10-19 17:45
+
+from django.db import migrations, models
+import django.db.models.expressions
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quotes', '0005_request_profile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='quote',
+            name='archived_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Дата архивации'),
+        ),
+        migrations.AddField(
+            model_name='quote',
+            name='is_active',
+            field=models.BooleanField(default=True, verbose_name='Активна'),
+        ),
+        migrations.AddIndex(
+            model_name='quote',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['id', 'weight'], name='quote_active_weight_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='quote',
+            index=models.Index(models.OrderBy(django.db.models.expressions.CombinedExpression(models.F('likes'), '-', models.F('dislikes')), descending=True), models.OrderBy(models.F('created_at'), descending=True), condition=models.Q(('is_active', True)), name='quote_active_popularity_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='quote',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['-views'], name='quote_active_views_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='quote',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['-created_at'], name='quote_active_created_idx'),
+        ),
+    ]
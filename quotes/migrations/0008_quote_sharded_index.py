@@ -0,0 +1,17 @@
+# Generated by Django 4.2.23 on 2026-10-19 17:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quotes', '0007_task_queue'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='quote',
+            index=models.Index(condition=models.Q(('sharded_counters', True)), fields=['id'], name='quote_sharded_idx'),
+        ),
+    ]
@@ -1,6 +1,15 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models.functions import Greatest
 from django.core.exceptions import ValidationError
 from django.urls import reverse
+from django.utils import timezone
+
+
+# Ограничение "не больше 3 цитат на источник"
+MAX_QUOTES_PER_SOURCE = 3
+
+# Наибольший первичный ключ (BigAutoField): большие числа из запроса переполняют целое в базе
+MAX_ID = 2 ** 63 - 1
 
 
 class SourceType(models.TextChoices):
@@ -11,9 +20,26 @@ class SourceType(models.TextChoices):
     OTHER = 'other', 'Другое'
 
 
+def normalize_title(title):
+    """Нормализованное название: без лишних пробелов и без учета регистра"""
+    return ' '.join(title.split()).casefold()
+
+
+class SourceQuerySet(models.QuerySet):
+    def title_prefix(self, prefix):
+        # Поиск по префиксу диапазоном, а не LIKE, чтобы работал индекс по normalized_title
+        prefix = normalize_title(prefix)
+        if not prefix:
+            return self
+        return self.filter(normalized_title__gte=prefix, normalized_title__lt=prefix + '\U0010ffff')
+
+
 class Source(models.Model):
     title = models.CharField(max_length=200, verbose_name="Название источника")
 
+    # Название в нижнем регистре для автодополнения и проверки дубликатов
+    normalized_title = models.CharField(max_length=200, editable=False, default='')
+
     type = models.CharField(
         max_length=10,
         choices=SourceType.choices,
@@ -24,15 +50,123 @@ class Source(models.Model):
     # Счетчик цитат. Нужен для проверки ограничения "не больше 3 цитат на источник".
     quote_count = models.PositiveIntegerField(default=0, verbose_name="Количество цитат")
 
+    objects = SourceQuerySet.as_manager()
+
     class Meta:
         verbose_name = "Источник"
         verbose_name_plural = "Источники"
+        indexes = [
+            models.Index(fields=['normalized_title', 'quote_count'], name='source_title_prefix_idx'),
+        ]
 
     def __str__(self):
         return f"{self.get_type_display()}: {self.title}"
 
+    def save(self, *args, **kwargs):
+        self.normalized_title = normalize_title(self.title)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'title' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'normalized_title'}
+        super().save(*args, **kwargs)
+
     def can_add_quote(self):
-        return self.quote_count < 3
+        return self.quote_count < MAX_QUOTES_PER_SOURCE
+
+
+def decrement_quote_counts(counts):
+    """Уменьшает quote_count нескольких источников одним UPDATE.
+
+    counts - словарь {source_id: сколько цитат удалено}.
+    """
+    if not counts:
+        return
+    decrement = models.Case(
+        *[models.When(pk=source_id, then=models.Value(n)) for source_id, n in counts.items()],
+        default=models.Value(0),
+        output_field=models.PositiveIntegerField(),
+    )
+    Source.objects.filter(pk__in=counts).update(
+        quote_count=Greatest(models.F('quote_count') - decrement, models.Value(0))
+    )
+
+
+def invalidate_sampling():
+    """Сбрасывает данные для случайного выбора после изменения набора цитат или весов"""
+    # Импорт внутри функции: sampling зависит от моделей и тянет NumPy
+    from .sampling import invalidate
+    invalidate()
+
+
+def invalidate_stats():
+    """Сбрасывает закэшированную статистику каталога"""
+    from .stats import invalidate
+    invalidate()
+
+
+class QuoteQuerySet(models.QuerySet):
+    def active(self):
+        # Рабочий набор: случайный выбор, популярные, статистика
+        return self.filter(is_active=True)
+
+    def archived(self):
+        return self.filter(is_active=False)
+
+    def stale(self, created_before, max_score=0, max_views=None):
+        """Кандидаты в архив: старые цитаты с низким рейтингом (лайки минус дизлайки).
+
+        Цитаты со счетчиками в шардах сейчас популярны и не считаются устаревшими.
+        """
+        quotes = self.annotate(score=models.F('likes') - models.F('dislikes')).filter(
+            created_at__lt=created_before, score__lte=max_score, sharded_counters=False,
+        )
+        if max_views is not None:
+            quotes = quotes.filter(views__lte=max_views)
+        return quotes
+
+    def archive(self):
+        """Переводит цитаты в архив, возвращает число измененных"""
+        updated = self.filter(is_active=True).update(is_active=False, archived_at=timezone.now())
+        if updated:
+            invalidate_sampling()
+            invalidate_stats()
+        return updated
+
+    archive.alters_data = True
+
+    def restore(self):
+        """Возвращает цитаты из архива, возвращает число измененных"""
+        updated = self.filter(is_active=False).update(is_active=True, archived_at=None)
+        if updated:
+            invalidate_sampling()
+            invalidate_stats()
+        return updated
+
+    restore.alters_data = True
+
+    def delete(self):
+        # Массовое удаление тоже должно освобождать места у источников
+        if self.query.is_sliced:
+            raise TypeError("Cannot use 'limit' or 'offset' with delete().")
+        with transaction.atomic(using=self.db):
+            counts = dict(
+                self.order_by().values_list('source_id').annotate(n=models.Count('id'))
+            )
+            # Без Collector: он читал бы все строки цитат в Python ради каскада на шарды.
+            # Шарды и цитаты удаляются двумя DELETE по условию
+            shards = QuoteCounterShard.objects.using(self.db).filter(
+                quote__in=self.order_by().values('pk')
+            )._raw_delete(self.db)
+            deleted = self._raw_delete(self.db)
+            decrement_quote_counts(counts)
+        invalidate_sampling()
+        invalidate_stats()
+        return deleted + shards, {
+            Quote._meta.label: deleted,
+            QuoteCounterShard._meta.label: shards,
+        }
+
+    delete.alters_data = True
+    delete.queryset_only = True
 
 
 class Quote(models.Model):
@@ -57,27 +191,66 @@ class Quote(models.Model):
     likes = models.PositiveIntegerField(default=0, verbose_name="Лайки")
     dislikes = models.PositiveIntegerField(default=0, verbose_name="Дизлайки")
 
+    # Счетчики "горячей" цитаты временно пишутся в шарды (см. quotes.counters)
+    sharded_counters = models.BooleanField(default=False, editable=False, verbose_name="Счетчики в шардах")
+
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
 
+    # Архивные цитаты не показываются и не учитываются в статистике, но остаются в базе
+    # (и по-прежнему занимают место у источника)
+    is_active = models.BooleanField(default=True, verbose_name="Активна")
+    archived_at = models.DateTimeField(null=True, blank=True, editable=False, verbose_name="Дата архивации")
+
+    objects = QuoteQuerySet.as_manager()
+
     class Meta:
         verbose_name = "Цитата"
         verbose_name_plural = "Цитаты"
         # Запрещаем дубликаты: не может быть двух цитат с одинаковым текстом И источником
         unique_together = ['text', 'source']
+        # Частичные индексы только по активным цитатам: их размер не растет вместе с архивом
+        indexes = [
+            models.Index(fields=['id', 'weight'], name='quote_active_weight_idx',
+                         condition=models.Q(is_active=True)),
+            models.Index(
+                (models.F('likes') - models.F('dislikes')).desc(), models.F('created_at').desc(),
+                name='quote_active_popularity_idx', condition=models.Q(is_active=True),
+            ),
+            models.Index(fields=['-views'], name='quote_active_views_idx',
+                         condition=models.Q(is_active=True)),
+            models.Index(fields=['-created_at'], name='quote_active_created_idx',
+                         condition=models.Q(is_active=True)),
+            # Цитаты со счетчиками в шардах (их немного) для рейтингов и статистики
+            models.Index(fields=['id'], name='quote_sharded_idx',
+                         condition=models.Q(sharded_counters=True)),
+        ]
 
     def __str__(self):
         # Берем первые 50 символов цитаты для отображения
         return f'"{self.text[:50]}..." из {self.source}'
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Запоминаем исходные источник и вес: при смене источника переносится счетчик,
+        # при смене веса перестраиваются данные для случайного выбора
+        instance._loaded_source_id = instance.__dict__.get('source_id')
+        instance._loaded_weight = instance.__dict__.get('weight')
+        instance._loaded_is_active = instance.__dict__.get('is_active')
+        return instance
+
     def clean(self):
         # Проверяем ограничение: у источника не больше 3 цитат
-        # Проверяем только если источник указан и это новая цитата
+        # Проверяем только если источник указан и это новая цитата.
+        # Здесь используется счетчик источника, без COUNT по цитатам;
+        # окончательно лимит проверяется атомарным UPDATE в save()
         if self.source_id and not self.pk:
-            # Используем актуальный счетчик из базы
-            current_count = Quote.objects.filter(source_id=self.source_id).count()
-            if current_count >= 3:
+            # Счетчик читается запросом, а не через self.source: несуществующий источник
+            # уже отмечен ошибкой поля, а обращение к нему бросило бы DoesNotExist
+            current_count = Source.objects.filter(pk=self.source_id).values_list('quote_count', flat=True).first()
+            if current_count is not None and current_count >= MAX_QUOTES_PER_SOURCE:
                 raise ValidationError(
-                    f'Нельзя добавить более 3 цитат для одного источника. '
+                    f'Нельзя добавить более {MAX_QUOTES_PER_SOURCE} цитат для одного источника. '
                     f'У источника "{self.source}" уже {current_count} цитат(ы).'
                 )
 
@@ -85,15 +258,156 @@ class Quote(models.Model):
         if self.weight < 1:
             raise ValidationError({'weight': 'Вес не может быть меньше 1.'})
 
+    def _reserve_source_slot(self):
+        # Условный UPDATE: счетчик увеличится, только если у источника еще есть место.
+        # Две параллельные вставки не смогут обе превысить лимит
+        reserved = Source.objects.filter(
+            pk=self.source_id, quote_count__lt=MAX_QUOTES_PER_SOURCE
+        ).update(quote_count=models.F('quote_count') + 1)
+        if not reserved:
+            raise ValidationError(
+                f'Нельзя добавить более {MAX_QUOTES_PER_SOURCE} цитат для одного источника.'
+            )
+
     def save(self, *args, **kwargs):
         is_new = not self.pk
+        old_source_id = getattr(self, '_loaded_source_id', None)
+        source_changed = not is_new and old_source_id is not None and old_source_id != self.source_id
+        weight_changed = getattr(self, '_loaded_weight', None) != self.weight
+        active_changed = not is_new and getattr(self, '_loaded_is_active', self.is_active) != self.is_active
+        if active_changed:
+            self.archived_at = None if self.is_active else timezone.now()
 
         self.full_clean()
 
-        super().save(*args, **kwargs)
+        # Резервирование места у источника и вставка идут в одной транзакции:
+        # если вставка упадет, счетчик откатится
+        with transaction.atomic():
+            if is_new or source_changed:
+                self._reserve_source_slot()
+            if source_changed:
+                decrement_quote_counts({old_source_id: 1})
+
+            super().save(*args, **kwargs)
+
+        self._loaded_source_id = self.source_id
+        self._loaded_weight = self.weight
+        self._loaded_is_active = self.is_active
+        if is_new or weight_changed or active_changed:
+            invalidate_sampling()
+        if is_new or active_changed:
+            invalidate_stats()
 
-        if is_new:
-            Source.objects.filter(pk=self.source_id).update(quote_count=models.F('quote_count') + 1)
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            decrement_quote_counts({self.source_id: 1})
+        invalidate_sampling()
+        invalidate_stats()
+        return result
 
     def get_absolute_url(self):
         return reverse('quote_detail', kwargs={'pk': self.pk})
+
+
+class QuoteCounterShard(models.Model):
+    """Часть счетчиков популярной цитаты.
+
+    Голоса распределяются случайно между несколькими строками, чтобы
+    параллельные запросы не ждали блокировку одной строки цитаты.
+    Периодическое сжатие переносит накопленное в Quote.
+    """
+    quote = models.ForeignKey(
+        Quote,
+        on_delete=models.CASCADE,
+        related_name='counter_shards',
+        verbose_name="Цитата"
+    )
+    shard = models.PositiveSmallIntegerField(verbose_name="Номер шарда")
+
+    views = models.PositiveIntegerField(default=0, verbose_name="Просмотры")
+    likes = models.PositiveIntegerField(default=0, verbose_name="Лайки")
+    dislikes = models.PositiveIntegerField(default=0, verbose_name="Дизлайки")
+
+    class Meta:
+        verbose_name = "Шард счетчиков"
+        verbose_name_plural = "Шарды счетчиков"
+        unique_together = ['quote', 'shard']
+
+    def __str__(self):
+        return f'Шард {self.shard} цитаты {self.quote_id}'
+
+
+class TaskStatus(models.TextChoices):
+    PENDING = 'pending', 'В очереди'
+    RUNNING = 'running', 'Выполняется'
+    FAILED = 'failed', 'Ошибка'
+
+
+class Task(models.Model):
+    """Отложенная задача для фонового обработчика (см. quotes.tasks).
+
+    Успешно выполненные задачи удаляются, поэтому таблица остается маленькой.
+    """
+    name = models.CharField(max_length=100, verbose_name="Задача")
+    payload = models.JSONField(default=dict, verbose_name="Параметры")
+    # Пока в очереди есть задача с тем же именем и ключом, новая не добавляется
+    dedupe_key = models.CharField(max_length=200, blank=True, verbose_name="Ключ дедупликации")
+    status = models.CharField(
+        max_length=10, choices=TaskStatus.choices, default=TaskStatus.PENDING, verbose_name="Статус"
+    )
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name="Попыток")
+    run_after = models.DateTimeField(default=timezone.now, verbose_name="Выполнить после")
+    locked_by = models.CharField(max_length=64, blank=True, verbose_name="Обработчик")
+    locked_at = models.DateTimeField(null=True, blank=True, verbose_name="Взята в работу")
+    last_error = models.TextField(blank=True, verbose_name="Последняя ошибка")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
+
+    class Meta:
+        verbose_name = "Задача"
+        verbose_name_plural = "Задачи"
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='task_queue_idx'),
+            models.Index(fields=['name', 'dedupe_key', 'status'], name='task_dedupe_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.name} ({self.get_status_display()})'
+
+
+class ProfileMode(models.TextChoices):
+    CPROFILE = 'cprofile', 'cProfile (pstats)'
+    SAMPLE = 'sample', 'Семплирование стеков (flamegraph)'
+
+
+class RequestProfile(models.Model):
+    """Профиль одного запроса, снятый ProfilingMiddleware.
+
+    data хранит файл для скачивания: marshal-дамп pstats для cProfile
+    или свернутые стеки (формат flamegraph.pl / speedscope) для семплирования.
+    """
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True, verbose_name="Дата")
+    method = models.CharField(max_length=10, verbose_name="Метод")
+    path = models.CharField(max_length=500, verbose_name="Адрес")
+    view_name = models.CharField(max_length=200, blank=True, verbose_name="Представление")
+    status_code = models.PositiveSmallIntegerField(verbose_name="Код ответа")
+    mode = models.CharField(max_length=10, choices=ProfileMode.choices, verbose_name="Режим")
+    duration_ms = models.FloatField(verbose_name="Время, мс")
+    sql_count = models.PositiveIntegerField(default=0, verbose_name="SQL-запросов")
+    sql_time_ms = models.FloatField(default=0, verbose_name="Время SQL, мс")
+    # Список {'sql', 'time_ms', 'origin'} в порядке выполнения
+    sql_queries = models.JSONField(default=list, verbose_name="SQL-запросы")
+    data = models.BinaryField(verbose_name="Данные профиля")
+
+    class Meta:
+        verbose_name = "Профиль запроса"
+        verbose_name_plural = "Профили запросов"
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f'{self.method} {self.path} ({self.duration_ms:.0f} мс)'
+
+    @property
+    def file_name(self):
+        extension = 'pstats' if self.mode == ProfileMode.CPROFILE else 'folded'
+        return f'profile-{self.pk}.{extension}'
@@ -0,0 +1,192 @@
+"""Профилирование отдельных запросов.
+
+ProfilingMiddleware профилирует запрос, если об этом попросил сотрудник
+(параметр ?_profile=cprofile|sample или заголовок X-Quotes-Profile) или если
+запрос попал в долю QUOTES_PROFILE_SAMPLE_RATE. Вместе с профилем записываются
+SQL-запросы со временем и местом в коде проекта, откуда они выполнены.
+Результат сохраняется в RequestProfile и скачивается из админки.
+
+Когда профилирование не запрошено, middleware только проверяет параметр,
+заголовок и долю выборки.
+"""
+import cProfile
+import marshal
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+
+from .models import ProfileMode, RequestProfile
+
+
+PROFILE_PARAM = '_profile'
+PROFILE_HEADER = 'HTTP_X_QUOTES_PROFILE'
+PROFILE_ID_HEADER = 'X-Quotes-Profile-Id'
+
+# Не больше стольких SQL-запросов сохраняется в профиле
+MAX_RECORDED_QUERIES = 500
+
+# Файлы проекта, в которых ищется место вызова SQL (без окружения и самого профилировщика)
+PROJECT_DIR = str(Path(settings.BASE_DIR).resolve())
+THIS_FILE = str(Path(__file__).resolve())
+
+
+def _project_origin(frame):
+    """Первая строка кода проекта в стеке: 'quotes/views.py:42 in dashboard'"""
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(PROJECT_DIR) and filename != THIS_FILE and 'site-packages' not in filename:
+            relative = filename[len(PROJECT_DIR):].lstrip('/\\')
+            return f'{relative}:{frame.f_lineno} in {frame.f_code.co_name}'
+        frame = frame.f_back
+    return ''
+
+
+class SqlRecorder:
+    """Обертка execute_wrapper, записывающая запросы со временем выполнения"""
+
+    def __init__(self):
+        self.queries = []
+        self.count = 0
+        self.total = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            self.count += 1
+            self.total += duration
+            if len(self.queries) < MAX_RECORDED_QUERIES:
+                self.queries.append({
+                    'sql': sql,
+                    'time_ms': round(duration * 1000, 3),
+                    'origin': _project_origin(sys._getframe(1)),
+                })
+
+
+class StackSampler:
+    """Статистический профилировщик: периодически снимает стек потока запроса.
+
+    Результат - свернутые стеки ('модуль:функция;...;модуль:функция число'),
+    которые принимают flamegraph.pl, speedscope и другие инструменты.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.stacks = Counter()
+        self._thread_id = threading.get_ident()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='quotes-profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{frame.f_globals.get("__name__", "?")}:{code.co_name}')
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def folded(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+
+def requested_mode(request):
+    """Режим профилирования запроса или None"""
+    mode = request.GET.get(PROFILE_PARAM) or request.META.get(PROFILE_HEADER)
+    if mode:
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_staff and mode in ProfileMode.values:
+            return mode
+        return None
+    rate = settings.QUOTES_PROFILE_SAMPLE_RATE
+    if rate and random.random() < rate:
+        # Случайные запросы профилируются семплированием: его накладные расходы меньше
+        return ProfileMode.SAMPLE
+    return None
+
+
+def prune_profiles():
+    """Оставляет только последние QUOTES_PROFILE_KEEP профилей"""
+    stale = RequestProfile.objects.values_list('pk', flat=True)[settings.QUOTES_PROFILE_KEEP:]
+    RequestProfile.objects.filter(pk__in=list(stale)).delete()
+
+
+class ProfilingMiddleware:
+    """Профилирует выбранные запросы. Должен стоять после AuthenticationMiddleware"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        mode = requested_mode(request)
+        if mode is None:
+            return self.get_response(request)
+        return self.profile(request, mode)
+
+    def profile(self, request, mode):
+        recorder = SqlRecorder()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+
+            if mode == ProfileMode.CPROFILE:
+                profiler = cProfile.Profile()
+                started = time.perf_counter()
+                try:
+                    profiler.enable()
+                except ValueError:
+                    # В процессе уже работает другой профилировщик
+                    return self.get_response(request)
+                try:
+                    response = self.get_response(request)
+                finally:
+                    profiler.disable()
+                duration = time.perf_counter() - started
+                profiler.create_stats()
+                # Тот же формат, что пишет pstats.Stats.dump_stats()
+                data = marshal.dumps(profiler.stats)
+            else:
+                sampler = StackSampler(settings.QUOTES_PROFILE_INTERVAL)
+                started = time.perf_counter()
+                sampler.start()
+                try:
+                    response = self.get_response(request)
+                finally:
+                    sampler.stop()
+                duration = time.perf_counter() - started
+                data = sampler.folded().encode()
+
+        match = getattr(request, 'resolver_match', None)
+        profile = RequestProfile.objects.create(
+            method=request.method,
+            path=request.get_full_path()[:500],
+            view_name=(match.view_name or '')[:200] if match else '',
+            status_code=response.status_code,
+            mode=mode,
+            duration_ms=duration * 1000,
+            sql_count=recorder.count,
+            sql_time_ms=recorder.total * 1000,
+            sql_queries=recorder.queries,
+            data=data,
+        )
+        prune_profiles()
+        response[PROFILE_ID_HEADER] = str(profile.pk)
+        return response
@@ -0,0 +1,161 @@
+"""Взвешенный случайный выбор цитат пакетами (NumPy).
+
+Вместо прохода по всей таблице на каждый запрос векторы (id, вес) загружаются
+один раз, а случайные id выбираются сразу пачкой через searchsorted по
+накопленной сумме весов. Здесь же - проверка распределения выборки
+(хи-квадрат и Колмогоров-Смирнов), которой пользуются тесты.
+"""
+import math
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from . import coherence
+from .models import Quote
+
+
+# Сколько id выбирается за один раз для показа на главной
+SAMPLE_BATCH_SIZE = 1024
+
+# Через сколько секунд перечитывать веса из базы, даже если поколение каталога не менялось
+# (изменения в обход приложения)
+SAMPLER_TTL = 300
+
+DistributionCheck = namedtuple('DistributionCheck', 'chi2 dof p_value ks ks_critical passed')
+
+
+class WeightedSampler:
+    """Выбор id с вероятностью, пропорциональной весу"""
+
+    def __init__(self, ids, weights):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.weights = np.asarray(weights, dtype=np.int64)
+        self.cumulative = np.cumsum(self.weights)
+        self.total = int(self.cumulative[-1]) if len(self.cumulative) else 0
+
+    def __len__(self):
+        return len(self.ids)
+
+    def sample(self, n, rng=None):
+        """Возвращает массив из n случайных id"""
+        if not self.total:
+            return np.empty(0, dtype=np.int64)
+        rng = rng or np.random.default_rng()
+        points = rng.random(n) * self.total
+        positions = np.searchsorted(self.cumulative, points, side='right')
+        # Защита от погрешности округления на правой границе
+        np.minimum(positions, len(self.ids) - 1, out=positions)
+        return self.ids[positions]
+
+
+def load_sampler():
+    """Строит WeightedSampler по текущим весам активных цитат"""
+    rows = Quote.objects.active().filter(weight__gte=1).order_by('id').values_list('id', 'weight')
+    data = np.array(list(rows), dtype=np.int64).reshape(-1, 2)
+    return WeightedSampler(data[:, 0], data[:, 1])
+
+
+def _chi2_sf(x, dof):
+    """Вероятность превысить x для хи-квадрат (приближение Уилсона-Хилферти)"""
+    if dof <= 0:
+        return 1.0
+    z = ((x / dof) ** (1 / 3) - (1 - 2 / (9 * dof))) / math.sqrt(2 / (9 * dof))
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def verify_distribution(samples, ids, weights, alpha=0.001):
+    """Проверяет, что выборка samples соответствует весам weights.
+
+    Считает критерий хи-квадрат (ячейки с ожидаемым числом попаданий меньше 5
+    объединяются) и статистику Колмогорова-Смирнова по функции распределения.
+    Выборка проходит проверку, если оба критерия не отвергают гипотезу на уровне alpha.
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    weights = np.asarray(weights, dtype=np.float64)
+    samples = np.asarray(samples, dtype=np.int64)
+    n = len(samples)
+
+    order = np.argsort(ids)
+    ids, weights = ids[order], weights[order]
+    positions = np.searchsorted(ids, samples)
+    if n and (positions.max() >= len(ids) or not np.array_equal(ids[positions], samples)):
+        raise ValueError('В выборке есть id, которых нет в распределении')
+
+    observed = np.bincount(positions, minlength=len(ids)).astype(np.float64)
+    probabilities = weights / weights.sum()
+    expected = probabilities * n
+
+    large = expected >= 5
+    observed_bins = observed[large]
+    expected_bins = expected[large]
+    if not large.all():
+        observed_bins = np.append(observed_bins, observed[~large].sum())
+        expected_bins = np.append(expected_bins, expected[~large].sum())
+    nonzero = expected_bins > 0
+    chi2 = float((((observed_bins - expected_bins) ** 2)[nonzero] / expected_bins[nonzero]).sum())
+    dof = int(nonzero.sum()) - 1
+    p_value = _chi2_sf(chi2, dof)
+
+    ks = float(np.abs(np.cumsum(observed) / n - np.cumsum(probabilities)).max()) if n else 0.0
+    ks_critical = math.sqrt(-math.log(alpha / 2) / 2) / math.sqrt(n) if n else 0.0
+
+    return DistributionCheck(chi2, dof, p_value, ks, ks_critical, p_value >= alpha and ks <= ks_critical)
+
+
+class SamplePool:
+    """Заранее выбранные пачкой id цитат для показа.
+
+    Сэмплер перестраивается при смене поколения каталога (см. coherence),
+    после invalidate() или по истечении SAMPLER_TTL. Перестраивает его один
+    поток, остальные ждут на блокировке.
+    """
+
+    def __init__(self, batch_size=SAMPLE_BATCH_SIZE, ttl=SAMPLER_TTL):
+        self.batch_size = batch_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._sampler = None
+        self._generation = None
+        self._loaded_at = 0.0
+        self._batch = []
+
+    def invalidate(self):
+        with self._lock:
+            self._sampler = None
+            self._batch = []
+
+    def _fill(self):
+        generation = coherence.generation(coherence.CATALOG)
+        if (self._sampler is None or generation != self._generation
+                or time.monotonic() - self._loaded_at > self.ttl):
+            self._sampler = load_sampler()
+            self._generation = generation
+            self._loaded_at = time.monotonic()
+            self._batch = []
+        if not self._batch:
+            self._batch = self._sampler.sample(self.batch_size).tolist()
+
+    def warm(self):
+        """Загружает веса и выбирает первую пачку заранее"""
+        with self._lock:
+            self._fill()
+
+    def next_id(self):
+        """Следующий случайный id или None, если показывать нечего"""
+        with self._lock:
+            self._fill()
+            return self._batch.pop() if self._batch else None
+
+
+sample_pool = SamplePool()
+
+
+def next_quote_id():
+    return sample_pool.next_id()
+
+
+def invalidate():
+    """Сообщает всем процессам об изменении набора цитат или их весов"""
+    coherence.bump(coherence.CATALOG)
@@ -0,0 +1,59 @@
+// Автодополнение источника: варианты подгружаются постранично по мере ввода
+document.addEventListener('DOMContentLoaded', function() {
+    document.querySelectorAll('[data-autocomplete-url]').forEach(input => {
+        const hidden = document.getElementById(input.dataset.target);
+        const results = input.parentElement.querySelector('.source-autocomplete-results');
+        let timer = null;
+        let page = 1;
+
+        async function load(append) {
+            const params = new URLSearchParams({q: input.value, page: page});
+            const response = await fetch(`${input.dataset.autocompleteUrl}?${params}`);
+            if (!response.ok) return;
+            const data = await response.json();
+
+            if (!append) results.innerHTML = '';
+            results.querySelector('.autocomplete-more')?.remove();
+
+            data.results.forEach(item => {
+                const option = document.createElement('button');
+                option.type = 'button';
+                option.className = 'list-group-item list-group-item-action';
+                option.textContent = item.text;
+                option.addEventListener('click', () => {
+                    hidden.value = item.id;
+                    input.value = item.text;
+                    results.innerHTML = '';
+                });
+                results.appendChild(option);
+            });
+
+            if (data.has_more) {
+                const more = document.createElement('button');
+                more.type = 'button';
+                more.className = 'list-group-item list-group-item-action text-muted autocomplete-more';
+                more.textContent = 'Показать еще...';
+                more.addEventListener('click', () => {
+                    page += 1;
+                    load(true);
+                });
+                results.appendChild(more);
+            }
+        }
+
+        input.addEventListener('input', () => {
+            // Введенный текст больше не соответствует выбранному источнику
+            hidden.value = '';
+            page = 1;
+            clearTimeout(timer);
+            timer = setTimeout(() => load(false), 250);
+        });
+        input.addEventListener('focus', () => {
+            page = 1;
+            load(false);
+        });
+        document.addEventListener('click', event => {
+            if (!input.parentElement.contains(event.target)) results.innerHTML = '';
+        });
+    });
+});
@@ -0,0 +1,90 @@
+"""Общая статистика каталога для дашборда.
+
+Агрегаты считаются только по активным цитатам (архив не учитывается), один
+раз, и хранятся в кэше STATS_TTL секунд (или до добавления, удаления или
+архивации цитат).
+"""
+import threading
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db.models import Count, Sum
+
+from . import coherence, tasks
+from .models import Quote, QuoteCounterShard, Source, SourceType
+
+
+STATS_CACHE_KEY = 'quotes:site-stats'
+STATS_TTL = 60
+
+# Пересчет при промахе выполняет один поток процесса
+_refresh_lock = threading.Lock()
+
+
+def cache_key():
+    # Ключ меняется вместе с поколением статистики, поэтому после изменения
+    # каталога все процессы сразу перестают видеть старое значение
+    return f'{STATS_CACHE_KEY}:{coherence.generation(coherence.STATS)}'
+
+
+def compute_site_stats():
+    totals = Quote.objects.active().aggregate(
+        total_quotes=Count('id'),
+        total_views=Sum('views'),
+        total_likes=Sum('likes'),
+    )
+    # Голоса и просмотры горячих цитат, еще не перенесенные из шардов
+    shards = QuoteCounterShard.objects.filter(quote__is_active=True).aggregate(
+        views=Sum('views'),
+        likes=Sum('likes'),
+    )
+
+    # Статистика по типам источников
+    sources_by_type = [
+        {**row, 'type_display': SourceType(row['type']).label}
+        for row in Source.objects.values('type').annotate(
+            count=Count('id'),
+            quote_count=Sum('quote_count')
+        ).order_by('-count')
+    ]
+
+    return {
+        'total_quotes': totals['total_quotes'],
+        'total_sources': sum(row['count'] for row in sources_by_type),
+        'total_views': (totals['total_views'] or 0) + (shards['views'] or 0),
+        'total_likes': (totals['total_likes'] or 0) + (shards['likes'] or 0),
+        'sources_by_type': sources_by_type,
+    }
+
+
+def refresh():
+    key = cache_key()
+    stats = compute_site_stats()
+    cache.set(key, stats, STATS_TTL)
+    return stats
+
+
+def get_site_stats():
+    stats = cache.get(cache_key())
+    if stats is None:
+        with _refresh_lock:
+            stats = cache.get(cache_key())
+            if stats is None:
+                stats = refresh()
+    return stats
+
+
+def invalidate():
+    coherence.bump(coherence.STATS)
+    # Пересчет в фоне, чтобы первый запрос дашборда не ждал агрегаты. Имеет смысл
+    # только с общим для процессов кэшем и фоновым обработчиком: иначе результат
+    # не увидят другие процессы, а текущий досчитает сам при промахе
+    if is_shared_cache() and not settings.QUOTES_TASKS_SYNC:
+        tasks.enqueue('refresh_stats', dedupe_key='site')
+
+
+def is_shared_cache():
+    """Виден ли кэш по умолчанию другим процессам (не LocMemCache и не DummyCache)"""
+    return not isinstance(caches['default'], (LocMemCache, DummyCache))
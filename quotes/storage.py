@@ -0,0 +1,70 @@
+"""Хранилище статических файлов с хешами в именах и сжатыми копиями.
+
+collectstatic добавляет к именам файлов хеш содержимого (их можно кэшировать
+навсегда) и рядом с каждым текстовым файлом кладет .gz и, если установлен
+пакет brotli, .br. Сжатые копии отдает веб-сервер или quotes.views.serve_static.
+"""
+import gzip
+import os
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Какие файлы сжимать (картинки и шрифты уже сжаты)
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.mjs', '.svg', '.json', '.txt', '.html', '.map')
+
+# Мелкие файлы не сжимаем: выигрыш меньше накладных расходов
+MIN_COMPRESS_SIZE = 256
+
+
+def compressed_variants(content):
+    """Сжатые варианты содержимого: {'.gz': ..., '.br': ...}"""
+    variants = {'.gz': gzip.compress(content, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['.br'] = brotli.compress(content, quality=11)
+    return variants
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """ManifestStaticFilesStorage, который дополнительно создает .gz/.br копии.
+
+    Пока collectstatic не запускался (разработка, тесты), манифеста нет, и
+    {% static %} возвращает исходные имена вместо ошибки.
+    """
+
+    def stored_name(self, name):
+        if not self.hashed_files:
+            return name
+        return super().stored_name(name)
+
+    def post_process(self, paths, dry_run=False, **options):
+        # CSS и JS обрабатываются в несколько проходов, сжимаем итоговые версии один раз
+        final_names = {}
+        for name, hashed_name, processed in super().post_process(paths, dry_run, **options):
+            if hashed_name and not isinstance(processed, Exception):
+                final_names[name] = hashed_name
+            yield name, hashed_name, processed
+        if not dry_run:
+            for hashed_name in final_names.values():
+                self.compress(hashed_name)
+
+    def compress(self, name):
+        if not name.endswith(COMPRESSIBLE_EXTENSIONS):
+            return
+        path = self.path(name)
+        with open(path, 'rb') as f:
+            content = f.read()
+        if len(content) < MIN_COMPRESS_SIZE:
+            return
+        for extension, compressed in compressed_variants(content).items():
+            # Сжатая копия, которая не меньше оригинала, только мешает
+            if len(compressed) < len(content):
+                with open(path + extension, 'wb') as f:
+                    f.write(compressed)
+            elif os.path.exists(path + extension):
+                os.remove(path + extension)
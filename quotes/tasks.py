@@ -0,0 +1,176 @@
+"""Очередь отложенных задач в базе данных.
+
+Представления и модели ставят в очередь работу, которую не нужно делать до
+ответа (пересчет статистики, перенос счетчиков из шардов), а команда
+run_worker выполняет ее пачками. Задачи с одинаковым ключом схлопываются,
+неудачные повторяются с растущей задержкой.
+
+Очередь ограничена QUOTES_TASK_QUEUE_LIMIT: если она заполнена, задача
+выполняется сразу в вызывающем процессе (так запросы замедляются, но работа
+не теряется и очередь не растет бесконечно). С QUOTES_TASKS_SYNC = True задачи
+выполняются сразу - для тестов и хостинга без фонового процесса.
+"""
+import logging
+import traceback
+import uuid
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Task, TaskStatus
+
+
+logger = logging.getLogger(__name__)
+
+# Зарегистрированные обработчики: имя -> TaskHandler
+registry = {}
+
+
+class TaskHandler:
+    def __init__(self, func, name, batch, max_attempts):
+        self.func = func
+        self.name = name
+        self.batch = batch
+        self.max_attempts = max_attempts
+
+    def run(self, payloads):
+        """Выполняет задачи: пакетный обработчик получает список параметров за один вызов"""
+        if self.batch:
+            self.func(payloads)
+        else:
+            for payload in payloads:
+                self.func(**payload)
+
+
+def task(name=None, batch=False, max_attempts=3):
+    """Регистрирует обработчик задачи.
+
+    Обработчик с batch=True получает список параметров всех взятых задач
+    с этим именем, остальные вызываются для каждой задачи с ее параметрами.
+    """
+    def decorator(func):
+        registry[name or func.__name__] = TaskHandler(func, name or func.__name__, batch, max_attempts)
+        return func
+    return decorator
+
+
+def enqueue(name, payload=None, dedupe_key='', delay=0):
+    """Ставит задачу в очередь. Возвращает Task или None, если задача выполнена сразу"""
+    handler = registry[name]
+    payload = payload or {}
+    if settings.QUOTES_TASKS_SYNC:
+        handler.run([payload])
+        return None
+
+    with transaction.atomic():
+        if dedupe_key:
+            existing = Task.objects.filter(name=name, dedupe_key=dedupe_key, status=TaskStatus.PENDING).first()
+            if existing:
+                return existing
+
+        queued = Task.objects.filter(status=TaskStatus.PENDING)[:settings.QUOTES_TASK_QUEUE_LIMIT].count()
+        if queued >= settings.QUOTES_TASK_QUEUE_LIMIT:
+            logger.warning('Очередь задач заполнена, задача %s выполняется сразу', name)
+            handler.run([payload])
+            return None
+
+        return Task.objects.create(
+            name=name,
+            payload=payload,
+            dedupe_key=dedupe_key,
+            run_after=timezone.now() + timedelta(seconds=delay),
+        )
+
+
+def claim(batch_size, worker_id):
+    """Забирает до batch_size готовых задач (в том числе брошенные упавшими обработчиками)"""
+    now = timezone.now()
+    expired = Task.objects.filter(
+        status=TaskStatus.RUNNING, locked_at__lt=now - timedelta(seconds=settings.QUOTES_TASK_LEASE)
+    )
+    # Задача, которая роняет обработчик, не должна забираться бесконечно
+    for name in set(expired.values_list('name', flat=True)):
+        handler = registry.get(name)
+        expired.filter(name=name, attempts__gte=handler.max_attempts if handler else 1).update(
+            status=TaskStatus.FAILED, locked_by='',
+            last_error=f'Обработчик не завершил задачу за {settings.QUOTES_TASK_LEASE} с',
+        )
+
+    ready = Task.objects.filter(
+        Q(status=TaskStatus.PENDING, run_after__lte=now)
+        | Q(status=TaskStatus.RUNNING, locked_at__lt=now - timedelta(seconds=settings.QUOTES_TASK_LEASE))
+    )
+    ids = list(ready.order_by('run_after', 'id').values_list('id', flat=True)[:batch_size])
+    # Условный UPDATE: задачу, которую успел забрать другой обработчик, повторно не забираем
+    ready.filter(id__in=ids).update(
+        status=TaskStatus.RUNNING, locked_by=worker_id, locked_at=now, attempts=F('attempts') + 1,
+    )
+    return list(Task.objects.filter(locked_by=worker_id, status=TaskStatus.RUNNING).order_by('id'))
+
+
+def run_pending(batch_size=100, worker_id=None):
+    """Выполняет одну пачку задач. Возвращает число взятых задач"""
+    worker_id = worker_id or uuid.uuid4().hex
+    claimed = claim(batch_size, worker_id)
+
+    by_name = defaultdict(list)
+    for queued in claimed:
+        by_name[queued.name].append(queued)
+
+    for name, group in by_name.items():
+        handler = registry.get(name)
+        try:
+            if handler is None:
+                raise LookupError(f'Неизвестная задача: {name}')
+            handler.run([queued.payload for queued in group])
+        except Exception:
+            error = traceback.format_exc()
+            logger.exception('Задача %s завершилась ошибкой', name)
+            for queued in group:
+                _retry_or_fail(queued, handler, error)
+        else:
+            Task.objects.filter(pk__in=[queued.pk for queued in group]).delete()
+    return len(claimed)
+
+
+def _retry_or_fail(queued, handler, error):
+    max_attempts = handler.max_attempts if handler else 1
+    if queued.attempts < max_attempts:
+        # Повтор через 2, 4, 8... секунд
+        Task.objects.filter(pk=queued.pk).update(
+            status=TaskStatus.PENDING, locked_by='', locked_at=None, last_error=error,
+            run_after=timezone.now() + timedelta(seconds=2 ** queued.attempts),
+        )
+    else:
+        Task.objects.filter(pk=queued.pk).update(status=TaskStatus.FAILED, locked_by='', last_error=error)
+
+
+@task(batch=True)
+def refresh_stats(payloads):
+    """Пересчитывает статистику дашборда (несколько запросов схлопываются в один пересчет)"""
+    from . import stats
+    stats.refresh()
+
+
+@task(batch=True)
+def refresh_aggregates(payloads):
+    """После голосов: сообщает процессам о новых рейтингах и пересчитывает статистику.
+
+    Статистика пересчитывается только в общем кэше: локальный кэш обработчика
+    процессам сайта не виден.
+    """
+    from . import leaderboards, stats
+    leaderboards.invalidate()
+    if stats.is_shared_cache():
+        stats.refresh()
+
+
+@task(batch=True)
+def compact_counters(payloads):
+    """Переносит голоса из шардов в цитаты одной пачкой"""
+    from . import counters
+    counters.compact({payload['quote_id'] for payload in payloads})
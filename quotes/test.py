@@ -1,9 +1,58 @@
-from django.test import TestCase, Client
-from django.urls import reverse
+import gzip
+import json
+import marshal
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
-from .models import Source, Quote, SourceType
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Sum
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import coherence, counters, sampling, stats, tasks, warmup
+from .datagen import generate_catalog
 from .forms import QuoteForm
-import json
+from .models import Quote, QuoteCounterShard, RequestProfile, Source, SourceType, Task, TaskStatus
+from .sampling import load_sampler, verify_distribution
+from .storage import CompressedManifestStaticFilesStorage
+
+
+# Настройка и таблица поколений, которые тесты модуля подменяют на время работы
+_coherence_state = {}
+
+
+def setUpModule():
+    # Тесты увеличивают поколения в своем файле, а не в файле работающего сайта.
+    # coherence.table создается из настроек при импорте, поэтому заменяется целиком
+    directory = tempfile.TemporaryDirectory()
+    override = override_settings(QUOTES_COHERENCE_FILE=os.path.join(directory.name, 'quotes-coherence.bin'))
+    override.enable()
+    _coherence_state.update(directory=directory, override=override, table=coherence.table)
+    coherence.table = coherence.GenerationTable(settings.QUOTES_COHERENCE_FILE)
+
+
+def tearDownModule():
+    coherence.table._close()
+    coherence.table = _coherence_state['table']
+    _coherence_state['override'].disable()
+    _coherence_state['directory'].cleanup()
 
 
 class BaseTestCase(TestCase):
@@ -46,6 +95,21 @@ class BaseTestCase(TestCase):
         )
 
 
+class GeneratedCatalogTestCase(TestCase):
+    """Базовый класс для тестов на сгенерированном каталоге реалистичной формы"""
+    catalog_sources_per_type = 20
+    catalog_quotes_per_source = 3
+    catalog_seed = 42
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalog = generate_catalog(
+            sources_per_type=cls.catalog_sources_per_type,
+            quotes_per_source=cls.catalog_quotes_per_source,
+            seed=cls.catalog_seed,
+        )
+
+
 class ModelTests(BaseTestCase):
     """Тесты моделей"""
 
@@ -99,6 +163,72 @@ class ModelTests(BaseTestCase):
         # Проверяем, что ошибка именно про лимит цитат
         self.assertIn('цитат', str(context.exception))
 
+    def test_missing_source_is_validation_error(self):
+        """Тест ошибки проверки, а не DoesNotExist, для несуществующего источника"""
+        with self.assertRaises(ValidationError) as context:
+            Quote(text="Цитата", source_id=424242, weight=1).full_clean()
+        self.assertIn('source', context.exception.message_dict)
+
+    def test_source_quote_limit_enforced_on_save(self):
+        """Тест атомарной проверки лимита при сохранении"""
+        Quote.objects.create(text="Цитата 2", source=self.source_movie, weight=1)
+        Quote.objects.create(text="Цитата 3", source=self.source_movie, weight=1)
+
+        # Параллельный запрос мог пройти clean() до того, как счетчик дошел до лимита,
+        # но условный UPDATE в save() не дает превысить лимит
+        with mock.patch.object(Quote, 'clean'), self.assertRaises(ValidationError):
+            Quote.objects.create(text="Цитата 4", source=self.source_movie, weight=1)
+
+        self.source_movie.refresh_from_db()
+        self.assertEqual(self.source_movie.quote_count, 3)
+        self.assertEqual(self.source_movie.quotes.count(), 3)
+
+    def test_quote_save_does_not_count_quotes(self):
+        """Тест отсутствия COUNT-запроса при сохранении цитаты"""
+        with CaptureQueriesContext(connection) as queries:
+            Quote.objects.create(text="Цитата 2", source=self.source_movie, weight=1)
+        self.assertFalse(any('COUNT(' in q['sql'] for q in queries.captured_queries))
+
+    def test_quote_delete_decrements_source_count(self):
+        """Тест уменьшения счетчика при удалении цитат"""
+        Quote.objects.create(text="Цитата 2", source=self.source_movie, weight=1)
+
+        self.quote1.delete()
+        self.source_movie.refresh_from_db()
+        self.assertEqual(self.source_movie.quote_count, 1)
+
+        Quote.objects.all().delete()
+        self.source_movie.refresh_from_db()
+        self.source_book.refresh_from_db()
+        self.assertEqual(self.source_movie.quote_count, 0)
+        self.assertEqual(self.source_book.quote_count, 0)
+
+    def test_queryset_delete_is_set_based(self):
+        """Тест массового удаления без чтения строк цитат и с удалением шардов"""
+        QuoteCounterShard.objects.create(quote=self.quote1, shard=0, likes=1)
+
+        with CaptureQueriesContext(connection) as queries:
+            result = Quote.objects.filter(source=self.source_movie).delete()
+        self.assertEqual(result, (2, {'quotes.Quote': 1, 'quotes.QuoteCounterShard': 1}))
+        self.assertFalse(any('"quotes_quote"."text"' in q['sql'] for q in queries.captured_queries))
+        self.assertEqual(sum(q['sql'].startswith('DELETE') for q in queries.captured_queries), 2)
+
+        self.assertFalse(QuoteCounterShard.objects.exists())
+        self.assertEqual(list(Quote.objects.all()), [self.quote2])
+        self.source_movie.refresh_from_db()
+        self.assertEqual(self.source_movie.quote_count, 0)
+
+    def test_quote_source_change_moves_count(self):
+        """Тест переноса счетчика при смене источника"""
+        quote = Quote.objects.get(pk=self.quote1.pk)
+        quote.source = self.source_book
+        quote.save()
+
+        self.source_movie.refresh_from_db()
+        self.source_book.refresh_from_db()
+        self.assertEqual(self.source_movie.quote_count, 0)
+        self.assertEqual(self.source_book.quote_count, 2)
+
 
 class ViewTests(BaseTestCase):
     """Тесты представлений"""
@@ -113,7 +243,9 @@ class ViewTests(BaseTestCase):
     def test_index_view_increases_views(self):
         """Тест увеличения счетчика просмотров"""
         initial_views = self.quote1.views
-        self.client.get(reverse('index'))
+        # Фиксируем случайный выбор, чтобы тест не зависел от удачи
+        with mock.patch('quotes.sampling.next_quote_id', return_value=self.quote1.id):
+            self.client.get(reverse('index'))
         self.quote1.refresh_from_db()
         self.assertEqual(self.quote1.views, initial_views + 1)
 
@@ -133,6 +265,16 @@ class ViewTests(BaseTestCase):
         self.assertIn('total_quotes', response.context)
         self.assertEqual(response.context['total_quotes'], 2)
 
+    def test_dashboard_stats_cached(self):
+        """Тест кэширования статистики дашборда и ее сброса при добавлении цитаты"""
+        self.client.get(reverse('dashboard'))
+        self.assertIsNotNone(cache.get(stats.cache_key()))
+
+        Quote.objects.create(text="Третья тестовая цитата", source=self.source_movie, weight=1)
+        self.assertIsNone(cache.get(stats.cache_key()))
+        response = self.client.get(reverse('dashboard'))
+        self.assertEqual(response.context['total_quotes'], 3)
+
     def test_about_view(self):
         """Тест страницы 'О проекте'"""
         response = self.client.get(reverse('about'))
@@ -150,6 +292,21 @@ class ViewTests(BaseTestCase):
 class FormTests(BaseTestCase):
     """Тесты форм"""
 
+    def test_quote_form_rejects_out_of_range_source(self):
+        """Тест ошибки формы, а не ошибки сервера, для id источника вне диапазона ключей"""
+        for value in ('99999999999999999999', '-1', 'abc'):
+            form = QuoteForm(data={'text': 'Цитата', 'source': value, 'weight': 1})
+            self.assertFalse(form.is_valid())
+            self.assertIn('source', form.errors)
+            # Повторный вывод формы с неверным значением тоже не обращается к базе с ним
+            self.assertIn('name="source"', str(form['source']))
+
+        response = self.client.post(reverse('add_quote'), {
+            'text': 'Цитата', 'source': '99999999999999999999', 'weight': 1,
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Quote.objects.filter(text='Цитата').exists())
+
     def test_quote_form_valid(self):
         """Тест валидной формы"""
         form_data = {
@@ -189,6 +346,39 @@ class FormTests(BaseTestCase):
         self.assertEqual(quote.source.title, 'Новый тестовый источник')
         self.assertEqual(quote.source.type, SourceType.MOVIE)
 
+    def test_quote_form_does_not_render_all_sources(self):
+        """Тест того, что форма не выводит весь список источников"""
+        html = str(QuoteForm()['source'])
+        self.assertNotIn(self.source_book.title, html)
+        self.assertIn(reverse('source_autocomplete'), html)
+
+    def test_quote_form_validates_only_submitted_source(self):
+        """Тест проверки только одного отправленного id источника"""
+        form = QuoteForm(data={'text': 'Новая цитата', 'source': self.source_book.id, 'weight': 1})
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(form.is_valid())
+        source_queries = [q['sql'] for q in queries.captured_queries if 'FROM "quotes_source"' in q['sql']]
+        self.assertTrue(source_queries)
+        for sql in source_queries:
+            self.assertIn('"quotes_source"."id" =', sql)
+
+    def test_quote_form_rejects_full_source(self):
+        """Тест отклонения источника без свободных мест"""
+        Source.objects.filter(pk=self.source_book.pk).update(quote_count=3)
+        form = QuoteForm(data={'text': 'Новая цитата', 'source': self.source_book.id, 'weight': 1})
+        self.assertFalse(form.is_valid())
+        self.assertIn('source', form.errors)
+
+    def test_quote_form_existing_source_title(self):
+        """Тест запрета нового источника с уже существующим названием"""
+        form = QuoteForm(data={
+            'text': 'Цитата',
+            'new_source_title': '  тестовый   ФИЛЬМ ',
+            'new_source_type': SourceType.MOVIE,
+            'weight': 1
+        })
+        self.assertFalse(form.is_valid())
+
 
 class APITests(BaseTestCase):
     """Тесты API endpoints"""
@@ -222,6 +412,350 @@ class APITests(BaseTestCase):
         self.quote1.refresh_from_db()
         self.assertEqual(self.quote1.dislikes, initial_dislikes + 1)
 
+    def test_vote_batch(self):
+        """Тест пакетной отправки голосов"""
+        votes = [
+            {'quote_id': self.quote1.id, 'vote': 1, 'timestamp': 1700000000},
+            {'quote_id': self.quote1.id, 'vote': 1, 'timestamp': 1700000001},
+            {'quote_id': self.quote1.id, 'vote': -1, 'timestamp': 1700000002},
+            {'quote_id': self.quote2.id, 'vote': -1, 'timestamp': 1700000003},
+            {'quote_id': 999999, 'vote': 1, 'timestamp': 1700000004},
+        ]
+        # Проверка id, UPDATE и чтение итогов (+ SAVEPOINT/RELEASE транзакции)
+        with self.assertNumQueries(5):
+            response = self.client.post(
+                reverse('vote_batch'),
+                data=json.dumps({'votes': votes}),
+                content_type='application/json'
+            )
+        self.assertEqual(response.status_code, 200)
+
+        self.quote1.refresh_from_db()
+        self.quote2.refresh_from_db()
+        self.assertEqual((self.quote1.likes, self.quote1.dislikes), (5, 2))
+        self.assertEqual((self.quote2.likes, self.quote2.dislikes), (7, 3))
+
+        response_data = json.loads(response.content)
+        self.assertEqual(response_data['quotes'][str(self.quote1.id)], {'likes': 5, 'dislikes': 2})
+        self.assertEqual(response_data['unknown_ids'], [999999])
+
+    def test_vote_batch_invalid(self):
+        """Тест отклонения некорректного пакета"""
+        response = self.client.post(
+            reverse('vote_batch'),
+            data=json.dumps({'votes': [{'quote_id': self.quote1.id, 'vote': 2}]}),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+
+        for vote in (
+            {'quote_id': self.quote1.id, 'vote': 1.0},
+            {'quote_id': self.quote1.id, 'vote': True},
+            {'quote_id': 2 ** 63, 'vote': 1},
+        ):
+            response = self.client.post(
+                reverse('vote_batch'), data=json.dumps({'votes': [vote]}), content_type='application/json'
+            )
+            self.assertEqual(response.status_code, 400)
+
+        self.quote1.refresh_from_db()
+        self.assertEqual(self.quote1.likes, 3)
+
+    def test_source_autocomplete(self):
+        """Тест автодополнения источников по префиксу"""
+        Source.objects.create(title="Тестовый сериал", type=SourceType.SERIES, quote_count=3)
+        Source.objects.create(title="Другой источник", type=SourceType.OTHER)
+
+        response = self.client.get(reverse('source_autocomplete'), {'q': 'ТЕСТОВ'})
+        self.assertEqual(response.status_code, 200)
+        response_data = json.loads(response.content)
+
+        # Источник без свободных мест и источник с другим названием не попадают в выдачу
+        self.assertEqual(
+            [item['id'] for item in response_data['results']],
+            [self.source_book.id, self.source_movie.id]
+        )
+        self.assertFalse(response_data['has_more'])
+
+    def test_source_autocomplete_pagination(self):
+        """Тест постраничной выдачи автодополнения"""
+        from .views import SOURCE_AUTOCOMPLETE_MAX_PAGE, SOURCE_AUTOCOMPLETE_PAGE_SIZE
+        for i in range(SOURCE_AUTOCOMPLETE_PAGE_SIZE):
+            Source.objects.create(title=f"Серия {i:02d}", type=SourceType.SERIES)
+
+        first = json.loads(self.client.get(reverse('source_autocomplete'), {'q': 'серия'}).content)
+        second = json.loads(self.client.get(reverse('source_autocomplete'), {'q': 'серия', 'page': 2}).content)
+        self.assertEqual(len(first['results']), SOURCE_AUTOCOMPLETE_PAGE_SIZE)
+        self.assertFalse(first['has_more'])
+        self.assertEqual(second['results'], [])
+
+        Source.objects.create(title="Серия 99", type=SourceType.SERIES)
+        first = json.loads(self.client.get(reverse('source_autocomplete'), {'q': 'серия'}).content)
+        second = json.loads(self.client.get(reverse('source_autocomplete'), {'q': 'серия', 'page': 2}).content)
+        self.assertTrue(first['has_more'])
+        self.assertEqual([item['text'] for item in second['results']], ['Сериал: Серия 99'])
+
+        # Огромный номер страницы ограничивается, а не переполняет OFFSET
+        response = self.client.get(reverse('source_autocomplete'), {'q': 'серия', 'page': 10 ** 30})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['page'], SOURCE_AUTOCOMPLETE_MAX_PAGE)
+
+
+class AdminTests(BaseTestCase):
+    """Тесты админки"""
+
+    def setUp(self):
+        super().setUp()
+        user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(user)
+        self.changelist_url = reverse('admin:quotes_quote_changelist')
+
+    def test_changelist_loads_sources_with_join(self):
+        """Тест загрузки источников в списке одним JOIN"""
+        for i in range(5):
+            source = Source.objects.create(title=f"Источник {i}", type=SourceType.BOOK)
+            Quote.objects.create(text=f"Цитата {i}", source=source, weight=1)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.changelist_url)
+        self.assertEqual(response.status_code, 200)
+        source_queries = [q for q in queries.captured_queries if 'FROM "quotes_source"' in q['sql']]
+        self.assertEqual(source_queries, [])
+
+    @override_settings(QUOTES_ADMIN_HIGH_VOLUME=True)
+    def test_changelist_high_volume_keyset(self):
+        """Тест перехода по курсору без COUNT(*) в режиме больших таблиц"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.changelist_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(any('COUNT(*)' in q['sql'] for q in queries.captured_queries))
+        self.assertEqual(list(response.context['cl'].result_list), [self.quote2, self.quote1])
+
+        response = self.client.get(self.changelist_url, {'after': self.quote2.id})
+        self.assertEqual(list(response.context['cl'].result_list), [self.quote1])
+
+        # Курсор вне диапазона id игнорируется
+        for after in ('abc', str(2 ** 70), str(-2 ** 70)):
+            response = self.client.get(self.changelist_url, {'after': after})
+            self.assertEqual(list(response.context['cl'].result_list), [self.quote2, self.quote1])
+
+    def test_changelist_source_filter(self):
+        """Тест фильтра по источнику"""
+        response = self.client.get(self.changelist_url, {'source__id__exact': self.source_book.id})
+        self.assertEqual(list(response.context['cl'].result_list), [self.quote2])
+        # Вместо списка всех источников выводится поле автодополнения с выбранным источником
+        self.assertContains(response, 'admin-autocomplete')
+        self.assertContains(response, str(self.source_book))
+        self.assertNotContains(response, f'source__id__exact={self.source_movie.id}')
+
+        # Неверный id - перенаправление на список без фильтров, а не ошибка сервера
+        for value in ('abc', str(2 ** 70)):
+            response = self.client.get(self.changelist_url, {'source__id__exact': value})
+            self.assertRedirects(response, f'{self.changelist_url}?e=1')
+
+    def test_source_admin_autocomplete_prefix(self):
+        """Тест поиска источников в автодополнении админки по префиксу"""
+        response = self.client.get(reverse('admin:autocomplete'), {
+            'app_label': 'quotes', 'model_name': 'quote', 'field_name': 'source', 'term': 'тестовая',
+        })
+        self.assertEqual(response.status_code, 200)
+        results = json.loads(response.content)['results']
+        self.assertEqual([item['id'] for item in results], [str(self.source_book.id)])
+
+    def test_set_weight_action(self):
+        """Тест массовой установки веса"""
+        response = self.client.post(self.changelist_url, {
+            'action': 'set_weight',
+            '_selected_action': [self.quote1.id, self.quote2.id],
+            'weight': 7,
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(set(Quote.objects.values_list('weight', flat=True)), {7})
+
+    def test_reset_counters_action(self):
+        """Тест массового сброса счетчиков"""
+        self.client.post(self.changelist_url, {
+            'action': 'reset_counters',
+            '_selected_action': [self.quote1.id],
+        })
+        self.quote1.refresh_from_db()
+        self.assertEqual((self.quote1.views, self.quote1.likes, self.quote1.dislikes), (0, 0, 0))
+
+    def test_bulk_delete_only_in_high_volume(self):
+        """Тест: удаление без подтверждения доступно только в режиме больших таблиц"""
+        response = self.client.get(self.changelist_url)
+        self.assertNotContains(response, 'value="bulk_delete"')
+        self.assertContains(response, 'value="delete_selected"')
+
+        self.client.post(self.changelist_url, {
+            'action': 'bulk_delete',
+            '_selected_action': [self.quote1.id],
+        })
+        self.assertTrue(Quote.objects.filter(pk=self.quote1.pk).exists())
+
+    @override_settings(QUOTES_ADMIN_HIGH_VOLUME=True)
+    def test_bulk_delete_action(self):
+        """Тест массового удаления с обновлением счетчиков источников"""
+        self.client.post(self.changelist_url, {
+            'action': 'bulk_delete',
+            '_selected_action': [self.quote1.id, self.quote2.id],
+        })
+        self.assertFalse(Quote.objects.exists())
+        self.assertEqual(set(Source.objects.values_list('quote_count', flat=True)), {0})
+
+
+class DataGenerationTests(GeneratedCatalogTestCase):
+    """Тесты генератора синтетических данных"""
+
+    def test_catalog_shape(self):
+        """Тест размеров каталога и соблюдения лимита цитат"""
+        types_count = len(SourceType.choices)
+        self.assertEqual(self.catalog, {'sources': 20 * types_count, 'quotes': 60 * types_count})
+        self.assertEqual(Source.objects.filter(type=SourceType.GAME).count(), 20)
+        self.assertEqual(set(Source.objects.values_list('quote_count', flat=True)), {3})
+        self.assertFalse(Quote.objects.filter(weight__lt=1).exists())
+
+        # Новая цитата к заполненному источнику не добавляется
+        with self.assertRaises(ValidationError):
+            Quote.objects.create(text="Лишняя цитата", source=Source.objects.first(), weight=1)
+
+    def test_catalog_is_deterministic(self):
+        """Тест воспроизводимости каталога при одинаковом seed"""
+        columns = ('text', 'weight', 'views', 'likes', 'dislikes')
+        first = list(Quote.objects.order_by('id').values_list(*columns))
+
+        Quote.objects.all().delete()
+        Source.objects.all().delete()
+        generate_catalog(sources_per_type=20, seed=self.catalog_seed)
+        second = list(Quote.objects.order_by('id').values_list(*columns))
+        self.assertEqual(first, second)
+
+    def test_weights_are_skewed(self):
+        """Тест распределения весов по Ципфу: вес 1 встречается чаще всего"""
+        weights = list(Quote.objects.values_list('weight', flat=True))
+        self.assertGreater(weights.count(1), weights.count(2))
+        self.assertGreater(weights.count(2), weights.count(10))
+
+    def test_generate_quotes_command(self):
+        """Тест команды generate_quotes"""
+        # Шарды счетчиков ссылаются на цитаты и очищаются вместе с ними
+        QuoteCounterShard.objects.create(quote=Quote.objects.first(), shard=0, likes=1)
+        out = StringIO()
+        call_command('generate_quotes', '--sources-per-type', '2', '--quotes-per-source', '1',
+                     '--clear', stdout=out)
+        self.assertFalse(QuoteCounterShard.objects.exists())
+        self.assertEqual(Quote.objects.count(), 2 * len(SourceType.choices))
+        self.assertIn('строк/с', out.getvalue())
+
+
+@override_settings(QUOTES_HOT_VOTES_PER_MINUTE=3, QUOTES_COUNTER_SHARDS=4)
+class CounterShardingTests(BaseTestCase):
+    """Тесты шардированных счетчиков горячих цитат"""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def like(self, quote):
+        return self.client.post(
+            reverse('like_quote', args=[quote.id]),
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest'
+        )
+
+    def test_hot_quote_switches_to_shards(self):
+        """Тест переключения на шарды после порога голосов"""
+        for _ in range(2):
+            self.like(self.quote1)
+        self.quote1.refresh_from_db()
+        self.assertFalse(self.quote1.sharded_counters)
+        self.assertEqual(self.quote1.likes, 5)
+
+        for _ in range(4):
+            response = self.like(self.quote1)
+        self.quote1.refresh_from_db()
+        self.assertTrue(self.quote1.sharded_counters)
+        # Голоса после порога пишутся в шарды, а не в строку цитаты
+        self.assertEqual(self.quote1.likes, 5)
+        self.assertEqual(self.quote1.counter_shards.count(), 4)
+
+        cache.clear()
+        self.assertEqual(counters.get_counts(self.quote1)['likes'], 9)
+        self.assertEqual(json.loads(response.content)['likes'], 9)
+
+    def test_vote_batch_writes_hot_quotes_to_shards(self):
+        """Тест записи пакетных голосов горячей цитаты в шарды, а холодной - в строку цитаты"""
+        Quote.objects.filter(pk=self.quote1.pk).update(sharded_counters=True)
+        votes = [{'quote_id': self.quote1.id, 'vote': 1}] * 3 + [
+            {'quote_id': self.quote1.id, 'vote': -1},
+            {'quote_id': self.quote2.id, 'vote': 1},
+        ]
+        response = self.client.post(reverse('vote_batch'), data=json.dumps({'votes': votes}),
+                                    content_type='application/json')
+        self.assertEqual(json.loads(response.content)['quotes'][str(self.quote1.id)], {'likes': 6, 'dislikes': 2})
+
+        self.quote1.refresh_from_db()
+        self.quote2.refresh_from_db()
+        self.assertEqual((self.quote1.likes, self.quote1.dislikes), (3, 1))
+        self.assertEqual(self.quote2.likes, 8)
+        # Все голоса цитаты из пакета - в одном шарде
+        shard = QuoteCounterShard.objects.get(quote=self.quote1, likes__gt=0)
+        self.assertEqual((shard.likes, shard.dislikes), (3, 1))
+
+    def test_popular_and_dashboard_include_shards(self):
+        """Тест учета голосов из шардов на страницах популярных цитат и статистики"""
+        for _ in range(9):
+            self.like(self.quote1)
+        self.quote1.refresh_from_db()
+        self.assertTrue(self.quote1.sharded_counters)
+        # В строке цитаты меньше лайков, чем у второй цитаты
+        self.assertLess(self.quote1.likes - self.quote1.dislikes, self.quote2.likes - self.quote2.dislikes)
+
+        response = self.client.get(reverse('popular_quotes'))
+        top = response.context['top_quotes']
+        self.assertEqual(top[0], self.quote1)
+        self.assertEqual(top[0].likes, 12)
+        self.assertContains(response, '👍 12 |')
+
+        response = self.client.get(reverse('dashboard'))
+        self.assertEqual(response.context['total_likes'], 12 + 7)
+
+    def test_compact_folds_shards_into_quote(self):
+        """Тест переноса шардов в цитату"""
+        for _ in range(6):
+            self.like(self.quote1)
+
+        cache.clear()
+        self.assertEqual(counters.compact(), 1)
+        self.quote1.refresh_from_db()
+        self.assertEqual(self.quote1.likes, 9)
+        # Цитата больше не горячая: шарды удалены, счетчики снова в строке цитаты
+        self.assertFalse(self.quote1.sharded_counters)
+        self.assertFalse(QuoteCounterShard.objects.exists())
+
+    def test_compact_keeps_shards_of_hot_quote(self):
+        """Тест сжатия горячей цитаты без удаления шардов"""
+        for _ in range(6):
+            self.like(self.quote1)
+
+        call_command('compact_counters', stdout=StringIO())
+        self.quote1.refresh_from_db()
+        self.assertEqual(self.quote1.likes, 9)
+        self.assertTrue(self.quote1.sharded_counters)
+        self.assertEqual(
+            QuoteCounterShard.objects.aggregate(total=Sum('likes'))['total'], 0
+        )
+        self.assertEqual(counters.get_counts(self.quote1)['likes'], 9)
+
+    def test_reset_clears_shards(self):
+        """Тест сброса счетчиков вместе с шардами"""
+        for _ in range(6):
+            self.like(self.quote1)
+        counters.reset(Quote.objects.filter(pk=self.quote1.pk))
+
+        self.quote1.refresh_from_db()
+        self.assertEqual(counters.get_counts(self.quote1), {'views': 0, 'likes': 0, 'dislikes': 0})
+        self.assertFalse(QuoteCounterShard.objects.exists())
+
 
 class EdgeCaseTests(TestCase):
     """Тесты граничных случаев"""
@@ -255,15 +789,479 @@ class EdgeCaseTests(TestCase):
             weight=1
         )
 
-        # Многократный вызов для проверки распределения
+        # Распределение проверяем на миллионе выборов пачкой
+        sampler = load_sampler()
+        samples = sampler.sample(1_000_000, rng=np.random.default_rng(0))
+        check = verify_distribution(samples, sampler.ids, sampler.weights)
+        self.assertTrue(check.passed, check)
+
+        high_weight_count = int((samples == high_weight_quote.id).sum())
+        low_weight_count = int((samples == low_weight_quote.id).sum())
+        self.assertAlmostEqual(high_weight_count / len(samples), 10 / 11, places=2)
+        self.assertGreater(high_weight_count, low_weight_count)
+
+        # Показ через get_random_quote использует те же веса
         from .views import get_random_quote
-        quotes = []
-        for _ in range(100):
-            quotes.append(get_random_quote())
+        quotes = [get_random_quote() for _ in range(100)]
+        self.assertGreater(quotes.count(high_weight_quote), 50)  # Должна быть больше половины
 
-        # High weight quote должна появляться значительно чаще
-        high_weight_count = quotes.count(high_weight_quote)
-        low_weight_count = quotes.count(low_weight_quote)
 
-        self.assertGreater(high_weight_count, low_weight_count)
-        self.assertGreater(high_weight_count, 50)  # Должна быть больше половины
\ No newline at end of file
+class SamplingTests(GeneratedCatalogTestCase):
+    """Тесты пакетного взвешенного выбора на большом каталоге"""
+
+    def setUp(self):
+        sampling.invalidate()
+
+    def test_distribution_on_catalog(self):
+        """Тест соответствия выборки весам каталога"""
+        sampler = load_sampler()
+        self.assertEqual(len(sampler), self.catalog['quotes'])
+
+        samples = sampler.sample(1_000_000, rng=np.random.default_rng(1))
+        check = verify_distribution(samples, sampler.ids, sampler.weights)
+        self.assertTrue(check.passed, check)
+
+    def test_verification_rejects_wrong_distribution(self):
+        """Тест того, что проверка замечает неверные веса"""
+        sampler = load_sampler()
+        samples = sampler.sample(1_000_000, rng=np.random.default_rng(2))
+        # Равномерные веса вместо настоящих
+        check = verify_distribution(samples, sampler.ids, np.ones(len(sampler)))
+        self.assertFalse(check.passed)
+
+    def test_random_quote_uses_single_query(self):
+        """Тест выбора цитаты одним запросом после загрузки весов"""
+        from .views import get_random_quote
+        self.assertIsNotNone(get_random_quote())
+        with self.assertNumQueries(1):
+            self.assertIsNotNone(get_random_quote())
+
+    def test_weight_change_invalidates_sampler(self):
+        """Тест перестройки выборки после изменения веса через модель и действие админки"""
+        first, second = Quote.objects.order_by('id')[:2]
+        samples = [sampling.next_quote_id() for _ in range(200)]
+        self.assertLess(samples.count(first.pk), 50)
+
+        # Вес, превышающий суммарный вес каталога, забирает почти всю выборку
+        first.weight = 1_000_000
+        first.save()
+        samples = [sampling.next_quote_id() for _ in range(200)]
+        self.assertGreater(samples.count(first.pk), 180)
+
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        self.client.post(reverse('admin:quotes_quote_changelist'), {
+            'action': 'set_weight',
+            '_selected_action': [second.pk],
+            'weight': 1_000_000,
+        })
+        samples = [sampling.next_quote_id() for _ in range(200)]
+        self.assertGreater(samples.count(second.pk), 60)
+        self.assertGreater(samples.count(first.pk), 60)
+
+
+class WarmupTests(BaseTestCase):
+    """Тесты прогрева процесса"""
+
+    def setUp(self):
+        super().setUp()
+        sampling.invalidate()
+        stats.invalidate()
+
+    def test_warm_up_loads_sampler_and_stats(self):
+        """Тест того, что после прогрева первый запрос не загружает веса и статистику"""
+        with mock.patch('quotes.warmup.connections.close_all') as close_all:
+            timings = warmup.run()
+        self.assertEqual(set(timings), {'urls', 'templates', 'sampling', 'stats', 'leaderboards'})
+        # Соединение, открытое вне запроса, закрывается сразу после прогрева
+        close_all.assert_called_once_with()
+        self.assertIsNotNone(cache.get(stats.cache_key()))
+
+        # Только выборка самой цитаты
+        from .views import get_random_quote
+        with self.assertNumQueries(1):
+            self.assertIsNotNone(get_random_quote())
+
+
+class ProfilingTests(BaseTestCase):
+    """Тесты профилирования запросов"""
+
+    def setUp(self):
+        super().setUp()
+        self.staff = User.objects.create_user('staff', password='password', is_staff=True)
+
+    def test_not_profiled_by_default(self):
+        """Тест того, что без запроса профиль не создается"""
+        response = self.client.get(reverse('dashboard'), {'_profile': 'cprofile'})
+        self.assertNotIn('X-Quotes-Profile-Id', response)
+        self.assertFalse(RequestProfile.objects.exists())
+
+    def test_cprofile_for_staff(self):
+        """Тест профиля cProfile с SQL-запросами и местом их вызова"""
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('dashboard'), {'_profile': 'cprofile'})
+        self.assertEqual(response.status_code, 200)
+
+        profile = RequestProfile.objects.get(pk=response['X-Quotes-Profile-Id'])
+        self.assertEqual(profile.view_name, 'dashboard')
+        self.assertEqual(profile.sql_count, len(profile.sql_queries))
+        self.assertTrue(any(q['origin'].startswith(('quotes/views.py', 'quotes/stats.py')) for q in profile.sql_queries))
+        stats = marshal.loads(bytes(profile.data))
+        self.assertTrue(any(func[2] == 'dashboard' for func in stats))
+
+    @override_settings(QUOTES_PROFILE_SAMPLE_RATE=1.0, QUOTES_PROFILE_INTERVAL=0.0005)
+    def test_sampled_profile_is_folded(self):
+        """Тест семплирования случайных запросов в свернутые стеки"""
+        response = self.client.get(reverse('popular_quotes'))
+        profile = RequestProfile.objects.get(pk=response['X-Quotes-Profile-Id'])
+        self.assertEqual(profile.mode, 'sample')
+        for line in bytes(profile.data).decode().splitlines():
+            stack, count = line.rsplit(' ', 1)
+            self.assertTrue(int(count) > 0 and stack)
+
+    def test_admin_download(self):
+        """Тест скачивания профиля из админки только сотрудником"""
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('about'), HTTP_X_QUOTES_PROFILE='cprofile')
+        profile_id = response['X-Quotes-Profile-Id']
+        url = reverse('admin:quotes_requestprofile_download', args=[profile_id])
+
+        # Без права просмотра профилей
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        admin_user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(admin_user)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(f'profile-{profile_id}.pstats', response['Content-Disposition'])
+
+
+class StaticAssetTests(TestCase):
+    """Тесты статических файлов"""
+
+    def setUp(self):
+        self.static_root = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.static_root)
+        self.content = b'console.log("quotes");\n' * 100
+        (self.static_root / 'quotes').mkdir()
+        (self.static_root / 'quotes' / 'app.0123456789ab.js').write_bytes(self.content)
+
+    def test_pages_use_local_assets(self):
+        """Тест того, что страницы не обращаются к CDN и не содержат встроенный скрипт"""
+        response = self.client.get(reverse('about'))
+        html = response.content.decode()
+        self.assertNotIn('cdn.jsdelivr.net', html)
+        self.assertNotIn('addEventListener', html)
+        # Без манифеста (collectstatic не запускался) имена файлов без хеша
+        self.assertIn('/static/quotes/js/voting.js', html)
+
+    def test_compress_creates_variants(self):
+        """Тест создания сжатой копии файла"""
+        storage = CompressedManifestStaticFilesStorage(location=self.static_root)
+        storage.compress('quotes/app.0123456789ab.js')
+        compressed = (self.static_root / 'quotes' / 'app.0123456789ab.js.gz').read_bytes()
+        self.assertEqual(gzip.decompress(compressed), self.content)
+        self.assertLess(len(compressed), len(self.content))
+
+    def test_serve_static_compressed_and_conditional(self):
+        """Тест раздачи сжатой копии с долгим кэшированием и ответом 304"""
+        CompressedManifestStaticFilesStorage(location=self.static_root).compress('quotes/app.0123456789ab.js')
+        url = reverse('static', kwargs={'path': 'quotes/app.0123456789ab.js'})
+        with override_settings(STATIC_ROOT=self.static_root):
+            response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Encoding'], 'gzip')
+            self.assertIn('immutable', response['Cache-Control'])
+            self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), self.content)
+
+            response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(response.status_code, 304)
+
+            # Клиент без поддержки сжатия получает исходный файл
+            response = self.client.get(url)
+            self.assertNotIn('Content-Encoding', response)
+            self.assertEqual(b''.join(response.streaming_content), self.content)
+
+            # Учитываются только целые названия кодировок, q=0 запрещает кодировку
+            for header in ('gzip;q=0', 'x-gzip', 'GZIP; q=0.0, identity', '*;q=0'):
+                response = self.client.get(url, HTTP_ACCEPT_ENCODING=header)
+                self.assertNotIn('Content-Encoding', response, header)
+            for header in ('GZip;q=0.5', 'br;q=0, *;q=0.1', 'deflate, gzip;q=1.0'):
+                response = self.client.get(url, HTTP_ACCEPT_ENCODING=header)
+                self.assertEqual(response['Content-Encoding'], 'gzip', header)
+
+    def test_serve_static_outside_root(self):
+        """Тест того, что файлы вне STATIC_ROOT не отдаются"""
+        with override_settings(STATIC_ROOT=self.static_root):
+            response = self.client.get('/static/../config/settings.py')
+            self.assertEqual(response.status_code, 404)
+
+
+class ArchiveTests(BaseTestCase):
+    """Тесты архивации цитат"""
+
+    def setUp(self):
+        super().setUp()
+        sampling.invalidate()
+        # quote1: рейтинг 2, quote2: рейтинг 5; обе добавлены год назад
+        Quote.objects.update(created_at=timezone.now() - timedelta(days=365))
+
+    def test_archived_quotes_not_served(self):
+        """Тест исключения архивных цитат из выбора, популярных и статистики"""
+        self.assertEqual(Quote.objects.filter(pk=self.quote1.pk).archive(), 1)
+
+        self.assertEqual(list(load_sampler().ids), [self.quote2.pk])
+        response = self.client.get(reverse('popular_quotes'))
+        self.assertEqual(list(response.context['top_quotes']), [self.quote2])
+        response = self.client.get(reverse('dashboard'))
+        self.assertEqual(response.context['total_quotes'], 1)
+
+        self.quote1.refresh_from_db()
+        self.assertFalse(self.quote1.is_active)
+        self.assertIsNotNone(self.quote1.archived_at)
+
+    def test_restore_and_save(self):
+        """Тест возврата из архива и архивации через сохранение модели"""
+        self.quote1.is_active = False
+        self.quote1.save()
+        self.assertIsNotNone(self.quote1.archived_at)
+        self.assertEqual(Quote.objects.archived().restore(), 1)
+        self.quote1.refresh_from_db()
+        self.assertTrue(self.quote1.is_active)
+        self.assertIsNone(self.quote1.archived_at)
+
+    def test_archive_quotes_command(self):
+        """Тест архивации устаревших цитат с низким рейтингом пачками"""
+        out = StringIO()
+        call_command('archive_quotes', '--max-score', '2', '--dry-run', stdout=out)
+        self.assertIn('Будет архивировано цитат: 1', out.getvalue())
+        self.assertEqual(Quote.objects.archived().count(), 0)
+
+        Quote.objects.create(text="Свежая цитата", source=self.source_movie, weight=1)
+        call_command('archive_quotes', '--max-score', '5', '--batch-size', '1', stdout=StringIO())
+        self.assertEqual(
+            set(Quote.objects.archived().values_list('pk', flat=True)), {self.quote1.pk, self.quote2.pk}
+        )
+
+
+@override_settings(QUOTES_TASKS_SYNC=False)
+class TaskQueueTests(BaseTestCase):
+    """Тесты очереди отложенных задач"""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        Task.objects.all().delete()
+        self.calls = []
+        tasks.task(name='test_record', max_attempts=2)(lambda **payload: self.calls.append(payload))
+        self.addCleanup(tasks.registry.pop, 'test_record')
+
+    @override_settings(QUOTES_TASKS_SYNC=True)
+    def test_sync_mode_runs_immediately(self):
+        """Тест синхронного режима"""
+        self.assertIsNone(tasks.enqueue('test_record', {'n': 1}))
+        self.assertEqual(self.calls, [{'n': 1}])
+        self.assertFalse(Task.objects.exists())
+
+    @override_settings(QUOTES_TASKS_SYNC=True)
+    def test_sync_mode_runs_builtin_tasks(self):
+        """Тест выполнения встроенных задач на месте в синхронном режиме"""
+        tasks.enqueue('refresh_stats', dedupe_key='site')
+        self.assertEqual(cache.get(stats.cache_key())['total_quotes'], 2)
+
+        self.quote1.sharded_counters = True
+        counters.increment(self.quote1, 'likes')
+        self.assertTrue(QuoteCounterShard.objects.exists())
+        tasks.enqueue('compact_counters', {'quote_id': self.quote1.pk})
+        self.assertFalse(QuoteCounterShard.objects.exists())
+        self.quote1.refresh_from_db()
+        self.assertEqual(self.quote1.likes, 4)
+
+    def test_stats_refresh_needs_shared_cache(self):
+        """Тест: с локальным кэшем пересчет статистики в очередь не ставится"""
+        Quote.objects.create(text="Третья тестовая цитата", source=self.source_movie, weight=1)
+        self.assertFalse(Task.objects.filter(name='refresh_stats').exists())
+
+    @mock.patch('quotes.stats.is_shared_cache', return_value=True)
+    def test_stats_refresh_deduplicated_and_run_by_worker(self, shared_cache):
+        """Тест схлопывания одинаковых задач и их выполнения обработчиком"""
+        Quote.objects.create(text="Третья тестовая цитата", source=self.source_movie, weight=1)
+        Quote.objects.create(text="Четвертая тестовая цитата", source=self.source_book, weight=1)
+        self.assertEqual(Task.objects.filter(name='refresh_stats').count(), 1)
+        self.assertIsNone(cache.get(stats.cache_key()))
+
+        out = StringIO()
+        call_command('run_worker', '--once', stdout=out)
+        self.assertIn('Обработано задач: 1', out.getvalue())
+        self.assertFalse(Task.objects.exists())
+        self.assertEqual(cache.get(stats.cache_key())['total_quotes'], 4)
+
+    def test_retry_then_fail(self):
+        """Тест повтора упавшей задачи и отметки об ошибке после последней попытки"""
+        tasks.task(name='test_record', max_attempts=2)(lambda **payload: 1 / 0)
+        queued = tasks.enqueue('test_record')
+
+        with self.assertLogs('quotes.tasks', 'ERROR'):
+            self.assertEqual(tasks.run_pending(), 1)
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.attempts), (TaskStatus.PENDING, 1))
+        self.assertIn('ZeroDivisionError', queued.last_error)
+        # Повтор отложен
+        self.assertEqual(tasks.run_pending(), 0)
+
+        Task.objects.update(run_after=timezone.now())
+        with self.assertLogs('quotes.tasks', 'ERROR'):
+            tasks.run_pending()
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.attempts), (TaskStatus.FAILED, 2))
+
+    def test_expired_lease_fails_after_last_attempt(self):
+        """Тест: задача, уронившая обработчик на последней попытке, отмечается ошибкой"""
+        stale = timezone.now() - timedelta(seconds=settings.QUOTES_TASK_LEASE + 1)
+        exhausted = Task.objects.create(name='test_record', status=TaskStatus.RUNNING, attempts=2,
+                                        locked_by='dead', locked_at=stale)
+        retried = Task.objects.create(name='test_record', status=TaskStatus.RUNNING, attempts=1,
+                                      locked_by='dead', locked_at=stale)
+
+        self.assertEqual(tasks.run_pending(), 1)
+        exhausted.refresh_from_db()
+        self.assertEqual(exhausted.status, TaskStatus.FAILED)
+        self.assertIn('не завершил', exhausted.last_error)
+        self.assertFalse(Task.objects.filter(pk=retried.pk).exists())
+        self.assertEqual(self.calls, [{}])
+
+    def test_votes_schedule_one_aggregates_refresh(self):
+        """Тест отложенного пересчета рейтингов после голосов, одного на несколько голосов"""
+        generation = coherence.generation(coherence.LEADERBOARDS)
+        self.client.post(reverse('like_quote', args=[self.quote1.id]), HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.client.post(reverse('dislike_quote', args=[self.quote2.id]), HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.client.post(reverse('vote_batch'), data=json.dumps({'votes': [{'quote_id': self.quote1.id, 'vote': 1}]}),
+                         content_type='application/json')
+        self.assertEqual(Task.objects.filter(name='refresh_aggregates').count(), 1)
+        self.assertEqual(coherence.generation(coherence.LEADERBOARDS), generation)
+
+        Task.objects.update(run_after=timezone.now())
+        self.assertEqual(tasks.run_pending(), 1)
+        self.assertGreater(coherence.generation(coherence.LEADERBOARDS), generation)
+
+    @override_settings(QUOTES_TASK_QUEUE_LIMIT=1)
+    def test_full_queue_runs_inline(self):
+        """Тест выполнения задачи на месте при заполненной очереди"""
+        self.assertIsNotNone(tasks.enqueue('test_record', {'n': 1}))
+        with self.assertLogs('quotes.tasks', 'WARNING'):
+            self.assertIsNone(tasks.enqueue('test_record', {'n': 2}))
+        self.assertEqual(self.calls, [{'n': 2}])
+        self.assertEqual(Task.objects.count(), 1)
+
+    @override_settings(QUOTES_HOT_VOTES_PER_MINUTE=3, QUOTES_COUNTER_SHARDS=4)
+    def test_hot_votes_schedule_compaction(self):
+        """Тест постановки в очередь сжатия шардов горячей цитаты"""
+        for _ in range(6):
+            self.client.post(reverse('like_quote', args=[self.quote1.id]), HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        compaction = Task.objects.get(name='compact_counters')
+        self.assertEqual(compaction.payload, {'quote_id': self.quote1.pk})
+
+        Task.objects.update(run_after=timezone.now())
+        tasks.run_pending()
+        self.quote1.refresh_from_db()
+        self.assertEqual(self.quote1.likes, 9)
+
+
+def _bump_many(path, count):
+    table = coherence.GenerationTable(path)
+    for _ in range(count):
+        table.increment(coherence.STATS)
+
+
+class CoherenceTests(BaseTestCase):
+    """Тесты согласования кэшей между процессами"""
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = str(Path(directory) / 'generations.bin')
+
+    def test_generation_shared_through_file(self):
+        """Тест того, что поколение, увеличенное через один отображенный файл, видно через другой"""
+        writer = coherence.GenerationTable(self.path)
+        reader = coherence.GenerationTable(self.path)
+        self.assertEqual(reader.get(coherence.CATALOG), 0)
+        writer.increment(coherence.CATALOG)
+        self.assertEqual(reader.get(coherence.CATALOG), 1)
+        self.assertEqual(reader.get(coherence.STATS), 0)
+
+    @unittest.skipIf(coherence.fcntl is None, 'нужна межпроцессная блокировка fcntl')
+    def test_concurrent_bumps_from_processes(self):
+        """Тест того, что одновременные увеличения из разных процессов не теряются"""
+        context = multiprocessing.get_context('fork')
+        processes = [context.Process(target=_bump_many, args=(self.path, 200)) for _ in range(4)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        self.assertEqual(coherence.GenerationTable(self.path).get(coherence.STATS), 800)
+
+    def test_reopen_after_fork_closes_inherited_file(self):
+        """Тест закрытия унаследованных отображения и дескриптора при открытии файла заново"""
+        table = coherence.GenerationTable(self.path)
+        table.increment(coherence.CATALOG)
+        buffer, fd = table._buffer, table._fd
+
+        # Так выглядит таблица в дочернем процессе после fork
+        table._pid = None
+        with mock.patch('quotes.coherence.os.close', wraps=os.close) as close:
+            self.assertEqual(table.get(coherence.CATALOG), 1)
+        self.assertTrue(buffer.closed)
+        close.assert_called_once_with(fd)
+        table._close()
+
+    def test_bump_again_after_commit(self):
+        """Тест повторного увеличения поколения после фиксации транзакции"""
+        before = coherence.generation(coherence.LEADERBOARDS)
+        with self.captureOnCommitCallbacks(execute=True):
+            coherence.bump(coherence.LEADERBOARDS)
+            self.assertEqual(coherence.generation(coherence.LEADERBOARDS), before + 1)
+        self.assertEqual(coherence.generation(coherence.LEADERBOARDS), before + 2)
+
+    def test_single_flight_reload(self):
+        """Тест того, что после смены поколения значение перезагружает один поток"""
+        loads = []
+        release = threading.Event()
+
+        def loader():
+            loads.append(1)
+            if len(loads) > 1:
+                release.wait(5)
+            return len(loads)
+
+        value = coherence.CoherentValue([coherence.LEADERBOARDS], loader)
+        self.assertEqual(value.get(), 1)
+        self.assertEqual(value.get(), 1)
+
+        coherence.bump(coherence.LEADERBOARDS)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(value.get())) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        # Пока один поток перезагружает, остальные сразу получают прежнее значение
+        deadline = time.monotonic() + 5
+        while len(results) < 7 and time.monotonic() < deadline:
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(loads), 2)
+        self.assertEqual(results.count(1), 7)
+        self.assertEqual(value.get(), 2)
+
+    def test_popular_page_reloaded_after_vote(self):
+        """Тест того, что популярные цитаты берутся из памяти до нового голоса"""
+        self.client.get(reverse('popular_quotes'))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('popular_quotes'))
+        self.assertEqual(response.context['top_quotes'][0], self.quote2)
+
+        for _ in range(5):
+            self.client.post(reverse('like_quote', args=[self.quote1.id]), HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        response = self.client.get(reverse('popular_quotes'))
+        self.assertEqual(response.context['top_quotes'][0], self.quote1)
@@ -6,6 +6,8 @@ urlpatterns = [
     path('add/', views.add_quote, name='add_quote'),
     path('like/<int:quote_id>/', views.like_quote, name='like_quote'),
     path('dislike/<int:quote_id>/', views.dislike_quote, name='dislike_quote'),
+    path('api/sources/autocomplete', views.source_autocomplete, name='source_autocomplete'),
+    path('api/votes/batch', views.vote_batch, name='vote_batch'),
     path('popular/', views.popular_quotes, name='popular_quotes'),
     path('dashboard/', views.dashboard, name='dashboard'),
     path('about/', views.about, name='about'),
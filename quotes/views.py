@@ -1,35 +1,62 @@
 from django.shortcuts import render, get_object_or_404, redirect
-from django.http import JsonResponse
-from django.db.models import Sum, F, Count
+from django.http import FileResponse, Http404, JsonResponse
+from django.db import transaction
+from django.db.models import F, Case, When, Value, PositiveIntegerField
 from django.contrib import messages
-from random import randint
-from .models import Quote, Source
-from .forms import QuoteForm
+from django.core.exceptions import SuspiciousFileOperation, ValidationError
+from django.conf import settings
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.utils._os import safe_join
+from django.views.decorators.http import require_safe
+from .models import Quote, Source, MAX_ID, MAX_QUOTES_PER_SOURCE
+from . import counters, leaderboards, sampling, stats
 from django.utils import timezone
 from datetime import timedelta
+import json
+import mimetypes
+import os
+import re
 
-def get_random_quote():
-    quotes = Quote.objects.filter(weight__gte=1)
-    if not quotes.exists():
-        return None
+# Максимальное количество голосов в одном пакете
+VOTE_BATCH_MAX_SIZE = 500
+
+# Размер страницы автодополнения источников
+SOURCE_AUTOCOMPLETE_PAGE_SIZE = 20
+# Дальше этой страницы автодополнение не листается (огромный номер переполнил бы OFFSET)
+SOURCE_AUTOCOMPLETE_MAX_PAGE = 50
 
-    total_weight = quotes.aggregate(Sum('weight'))['weight__sum']
+# Имена файлов с хешем содержимого (ManifestStaticFilesStorage): style.0123456789ab.css
+HASHED_STATIC_RE = re.compile(r'\.[0-9a-f]{12}\.[^/]+$')
 
-    random_num = randint(1, total_weight)
+# Сжатые копии статических файлов в порядке предпочтения
+STATIC_ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
 
-    current_weight = 0
-    for quote in quotes:
-        current_weight += quote.weight
-        if random_num <= current_weight:
+def get_random_quote():
+    """Случайная цитата с учетом веса.
+
+    id берется из заранее выбранной пачки (см. sampling), так что на показ
+    приходится один запрос по первичному ключу вместо прохода по всей таблице.
+    """
+    # Вторая попытка нужна, если выбранную цитату успели удалить или архивировать
+    for _ in range(2):
+        quote_id = sampling.next_quote_id()
+        if quote_id is None:
+            return None
+        quote = Quote.objects.active().select_related('source').filter(pk=quote_id).first()
+        if quote:
             return quote
+        # Изменивший каталог процесс уже сменил поколение, перечитываем только у себя
+        sampling.sample_pool.invalidate()
+    return None
 
 
 def index(request):
     random_quote = get_random_quote()
 
     if random_quote:
-        random_quote.views += 1
-        random_quote.save()
+        counters.increment(random_quote, 'views')
+        counters.apply_counts(random_quote)
 
     context = {'quote': random_quote}
     return render(request, 'quotes/index.html', context)
@@ -37,31 +64,65 @@ def index(request):
 
 def add_quote(request):
     """Страница добавления новой цитаты"""
+    # Формы нужны только на этой странице, поэтому импортируются при первом обращении
+    from .forms import QuoteForm
+
     if request.method == 'POST':
         form = QuoteForm(request.POST)
         if form.is_valid():
-            quote = form.save()
-            messages.success(request, 'Цитата успешно добавлена!')
-            return redirect('index')
+            try:
+                form.save()
+            except ValidationError as e:
+                # Лимит источника мог закончиться между валидацией и сохранением
+                form.add_error(None, e)
+            else:
+                messages.success(request, 'Цитата успешно добавлена!')
+                return redirect('index')
     else:
         form = QuoteForm()
 
     return render(request, 'quotes/add_quote.html', {'form': form})
 
 
+def source_autocomplete(request):
+    """Автодополнение источников по префиксу названия (постранично)"""
+    try:
+        page = min(max(int(request.GET.get('page', 1)), 1), SOURCE_AUTOCOMPLETE_MAX_PAGE)
+    except ValueError:
+        page = 1
+
+    offset = (page - 1) * SOURCE_AUTOCOMPLETE_PAGE_SIZE
+    # Берем на одну запись больше, чтобы узнать, есть ли следующая страница
+    sources = list(
+        Source.objects.filter(quote_count__lt=MAX_QUOTES_PER_SOURCE)
+        .title_prefix(request.GET.get('q', ''))
+        .order_by('normalized_title', 'id')[offset:offset + SOURCE_AUTOCOMPLETE_PAGE_SIZE + 1]
+    )
+
+    return JsonResponse({
+        'results': [
+            {'id': source.id, 'text': str(source)}
+            for source in sources[:SOURCE_AUTOCOMPLETE_PAGE_SIZE]
+        ],
+        'page': page,
+        'has_more': len(sources) > SOURCE_AUTOCOMPLETE_PAGE_SIZE and page < SOURCE_AUTOCOMPLETE_MAX_PAGE,
+    })
+
+
 def like_quote(request, quote_id):
     """Обработчик лайка (AJAX)"""
     if request.method == 'POST' and request.headers.get('X-Requested-With') == 'XMLHttpRequest':
         try:
             quote = get_object_or_404(Quote, id=quote_id)
-            quote.likes += 1
-            quote.save()
+            counters.increment(quote, 'likes')
+            counters.apply_counts(quote)
+            leaderboards.votes_changed()
 
             # Получаем следующую случайную цитату
             next_quote = get_random_quote()
             if next_quote:
-                next_quote.views += 1
-                next_quote.save()
+                counters.increment(next_quote, 'views')
+                counters.apply_counts(next_quote)
 
             return JsonResponse({
                 'likes': quote.likes,
@@ -85,14 +146,15 @@ def dislike_quote(request, quote_id):
     if request.method == 'POST' and request.headers.get('X-Requested-With') == 'XMLHttpRequest':
         try:
             quote = get_object_or_404(Quote, id=quote_id)
-            quote.dislikes += 1
-            quote.save()
+            counters.increment(quote, 'dislikes')
+            counters.apply_counts(quote)
+            leaderboards.votes_changed()
 
             # Получаем следующую случайную цитату
             next_quote = get_random_quote()
             if next_quote:
-                next_quote.views += 1
-                next_quote.save()
+                counters.increment(next_quote, 'views')
+                counters.apply_counts(next_quote)
 
             return JsonResponse({
                 'likes': quote.likes,
@@ -111,20 +173,114 @@ def dislike_quote(request, quote_id):
     return JsonResponse({'error': 'Invalid request'}, status=400)
 
 
-def popular_quotes(request):
-    """Страница с популярными цитатами"""
-    top_quotes = Quote.objects.annotate(
-        popularity=F('likes') - F('dislikes')
-    ).order_by('-popularity', '-created_at')[:10]
+def _parse_vote_batch(body):
+    """Разбирает тело пакетного запроса и суммирует голоса по цитатам.
+
+    Возвращает словарь {quote_id: [лайки, дизлайки]} или бросает ValueError.
+    """
+    try:
+        data = json.loads(body)
+    except (TypeError, ValueError):
+        raise ValueError('Некорректный JSON')
+
+    votes = data.get('votes') if isinstance(data, dict) else None
+    if not isinstance(votes, list) or not votes:
+        raise ValueError('Поле votes должно быть непустым списком')
+    if len(votes) > VOTE_BATCH_MAX_SIZE:
+        raise ValueError(f'Не более {VOTE_BATCH_MAX_SIZE} голосов в одном пакете')
+
+    totals = {}
+    for vote in votes:
+        if not isinstance(vote, dict):
+            raise ValueError('Каждый голос должен быть объектом')
+        quote_id = vote.get('quote_id')
+        value = vote.get('vote')
+        timestamp = vote.get('timestamp')
+        # type() вместо isinstance(): bool - подкласс int, а 1.0 == 1
+        if type(quote_id) is not int or not 1 <= quote_id <= MAX_ID:
+            raise ValueError('Некорректный quote_id')
+        if type(value) is not int or value not in (1, -1):
+            raise ValueError('Голос должен быть равен 1 или -1')
+        if timestamp is not None and (not isinstance(timestamp, (int, float)) or isinstance(timestamp, bool)):
+            raise ValueError('Некорректный timestamp')
+
+        counts = totals.setdefault(quote_id, [0, 0])
+        counts[0 if value == 1 else 1] += 1
+    return totals
+
+
+def _increment_case(increments):
+    """CASE-выражение с приращением счетчика для каждой цитаты"""
+    return Case(
+        *[When(pk=quote_id, then=Value(n)) for quote_id, n in increments.items()],
+        default=Value(0),
+        output_field=PositiveIntegerField(),
+    )
+
+
+def vote_batch(request):
+    """Пакетная отправка голосов (для виджетов и офлайн-клиентов).
+
+    Все id проверяются одним запросом, а голоса применяются одним UPDATE в транзакции
+    (у цитат со счетчиками в шардах - UPDATE случайного шарда).
+    Голоса за несуществующие цитаты пропускаются и возвращаются в unknown_ids.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid request'}, status=400)
+
+    try:
+        totals = _parse_vote_batch(request.body)
+    except ValueError as e:
+        return JsonResponse({'error': str(e), 'status': 'error'}, status=400)
+
+    with transaction.atomic():
+        known = dict(Quote.objects.filter(id__in=totals).values_list('id', 'sharded_counters'))
+        known_ids = set(known)
+        unknown_ids = sorted(set(totals) - known_ids)
+
+        # Горячие цитаты получают голоса через шарды, иначе пакеты снова упрутся
+        # в блокировку одной строки
+        counters.increment_many({
+            qid: {field: n for field, n in zip(counters.VOTE_FIELDS, totals[qid]) if n}
+            for qid, sharded in known.items() if sharded
+        })
+
+        cold_ids = [qid for qid, sharded in known.items() if not sharded]
+        likes = {qid: totals[qid][0] for qid in cold_ids if totals[qid][0]}
+        dislikes = {qid: totals[qid][1] for qid in cold_ids if totals[qid][1]}
+
+        if cold_ids:
+            Quote.objects.filter(id__in=cold_ids).update(
+                likes=F('likes') + _increment_case(likes),
+                dislikes=F('dislikes') + _increment_case(dislikes),
+            )
+
+        rows = list(Quote.objects.filter(id__in=known_ids).values_list('id', 'likes', 'dislikes', 'sharded_counters'))
+
+    if known_ids:
+        leaderboards.votes_changed()
+
+    # У горячих цитат часть голосов еще лежит в шардах
+    sharded = counters.shard_totals([row[0] for row in rows if row[3]]) if any(row[3] for row in rows) else {}
+    quotes = {}
+    for quote_id, quote_likes, quote_dislikes, _ in rows:
+        extra = sharded.get(quote_id, {})
+        quotes[str(quote_id)] = {
+            'likes': quote_likes + extra.get('likes', 0),
+            'dislikes': quote_dislikes + extra.get('dislikes', 0),
+        }
+
+    return JsonResponse({
+        'status': 'success',
+        'quotes': quotes,
+        'unknown_ids': unknown_ids,
+    })
 
-    # Дополнительные выборки
-    most_viewed = Quote.objects.order_by('-views')[:5]
-    recent_quotes = Quote.objects.order_by('-created_at')[:5]
 
+def popular_quotes(request):
+    """Страница с популярными цитатами"""
     context = {
-        'top_quotes': top_quotes,
-        'most_viewed': most_viewed,
-        'recent_quotes': recent_quotes,
+        **leaderboards.get_leaderboards(),
         'active_tab': 'popular'
     }
     return render(request, 'quotes/popular.html', context)
@@ -132,34 +288,22 @@ def popular_quotes(request):
 
 def dashboard(request):
     """Дашборд со статистикой"""
-    total_quotes = Quote.objects.count()
-    total_sources = Source.objects.count()
-    total_views = Quote.objects.aggregate(Sum('views'))['views__sum'] or 0
-    total_likes = Quote.objects.aggregate(Sum('likes'))['likes__sum'] or 0
-
-    # Статистика по типам источников
-    sources_by_type = Source.objects.values('type').annotate(
-        count=Count('id'),
-        quote_count=Sum('quote_count')
-    ).order_by('-count')
+    # Общие счетчики и распределение по типам берутся из кэша
+    site_stats = stats.get_site_stats()
 
     # Недавняя активность
     last_week = timezone.now() - timedelta(days=7)
-    recent_activity = Quote.objects.filter(
+    recent_activity = Quote.objects.active().filter(
         created_at__gte=last_week
     ).order_by('-created_at')[:10]
 
     # Цитаты с лучшим соотношением лайков/дизлайков
-    best_ratio = Quote.objects.annotate(
+    best_ratio = Quote.objects.active().annotate(
         ratio=F('likes') / (F('dislikes'))  # +1 чтобы избежать деления на 0
     ).filter(likes__gt=0).order_by('-ratio')[:5]
 
     context = {
-        'total_quotes': total_quotes,
-        'total_sources': total_sources,
-        'total_views': total_views,
-        'total_likes': total_likes,
-        'sources_by_type': sources_by_type,
+        **site_stats,
         'recent_activity': recent_activity,
         'best_ratio': best_ratio,
         'active_tab': 'dashboard'
@@ -173,6 +317,67 @@ def about(request):
     }
     return render(request, 'quotes/about.html', context)
 
+def _accepted_encodings(header):
+    """Разбирает Accept-Encoding: {'gzip': 1.0, 'br': 0.0, '*': 0.5}"""
+    accepted = {}
+    for item in header.split(','):
+        name, _, params = item.partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[name] = quality
+    return accepted
+
+@require_safe
+def serve_static(request, path):
+    """Раздача собранной статики, если веб-сервер не настроен на STATIC_ROOT.
+
+    Отдает .br/.gz копию по Accept-Encoding, файлы с хешем в имени кэшируются
+    на год, остальные перепроверяются по ETag и Last-Modified (ответ 304).
+    """
+    try:
+        full_path = safe_join(settings.STATIC_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404
+    if not os.path.isfile(full_path):
+        raise Http404
+
+    served_path, encoding = full_path, None
+    accepted = _accepted_encodings(request.headers.get('Accept-Encoding', ''))
+    # Кодировка с наибольшим весом клиента; q=0 запрещает ее, при равных весах - наш порядок
+    best = 0.0
+    for name, extension in STATIC_ENCODINGS:
+        quality = accepted.get(name, accepted.get('*', 0.0))
+        if quality > best and os.path.isfile(full_path + extension):
+            served_path, encoding, best = full_path + extension, name, quality
+
+    stat = os.stat(served_path)
+    etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    response = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if response is None:
+        content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+        response = FileResponse(
+            open(served_path, 'rb'), content_type=content_type, filename=os.path.basename(full_path)
+        )
+        if encoding:
+            response['Content-Encoding'] = encoding
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    response['Vary'] = 'Accept-Encoding'
+    if HASHED_STATIC_RE.search(path):
+        response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    else:
+        response['Cache-Control'] = 'public, max-age=0, must-revalidate'
+    return response
+
 def handler404(request, exception):
     """Обработчик 404 ошибки"""
     return render(request, 'quotes/404.html', status=404)
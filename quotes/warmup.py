@@ -0,0 +1,64 @@
+"""Прогрев рабочего процесса после старта.
+
+На хостинге процессы часто перезапускаются, и без прогрева первый запрос
+платит за импорт представлений, компиляцию шаблонов, загрузку весов для
+случайного выбора и подсчет статистики. warm_up() делает это заранее.
+
+Прогрев запускается синхронно из config/wsgi.py, а не из AppConfig.ready():
+так он не выполняется в командах manage.py и не работает в фоновом потоке
+в момент fork (с gunicorn --preload или uWSGI без lazy-apps мастер прогревается
+до fork, и потомки наследуют готовые данные, а не захваченные блокировки).
+"""
+import logging
+import time
+
+from django.db import DatabaseError, connections
+from django.template.loader import get_template
+from django.urls import get_resolver
+
+
+logger = logging.getLogger(__name__)
+
+# Шаблоны самых частых страниц
+WARMUP_TEMPLATES = (
+    'quotes/index.html',
+    'quotes/popular.html',
+    'quotes/dashboard.html',
+    'quotes/about.html',
+)
+
+
+def warm_up():
+    """Выполняет прогрев и возвращает время каждого шага в секундах"""
+    timings = {}
+
+    def step(name, func):
+        started = time.perf_counter()
+        func()
+        timings[name] = time.perf_counter() - started
+
+    try:
+        # URLconf тянет за собой quotes.views, sampling и NumPy
+        step('urls', lambda: get_resolver().url_patterns)
+        step('templates', lambda: [get_template(name) for name in WARMUP_TEMPLATES])
+
+        from . import leaderboards, sampling, stats
+        step('sampling', sampling.sample_pool.warm)
+        step('stats', stats.get_site_stats)
+        step('leaderboards', leaderboards.get_leaderboards)
+    except DatabaseError:
+        # Например, миграции еще не применены
+        logger.warning('Прогрев не выполнен: база данных недоступна', exc_info=True)
+    return timings
+
+
+def run():
+    """Прогрев при загрузке WSGI-приложения.
+
+    Соединения с базой закрываются: вне запроса их никто не закроет, а после
+    fork потомки не должны пользоваться соединением мастера.
+    """
+    try:
+        return warm_up()
+    finally:
+        connections.close_all()
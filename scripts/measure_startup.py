@@ -0,0 +1,81 @@
+"""Замер времени до первого ответа после старта процесса.
+
+Каждый прогон запускает новый интерпретатор, который импортирует Django,
+создает WSGI-приложение и сразу отправляет запрос - так же, как после
+перезапуска воркера на хостинге. Пример:
+
+    python scripts/measure_startup.py --runs 5 --path /
+    python scripts/measure_startup.py --runs 5 --warmup
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+CHILD = r'''
+import json, os, sys, time
+started = time.perf_counter()
+
+from wsgiref.util import setup_testing_defaults
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+# С QUOTES_WARMUP=True прогрев выполняется здесь же, при загрузке config.wsgi
+from config.wsgi import application
+app_ready = time.perf_counter()
+
+
+def request(path):
+    environ = {'PATH_INFO': path, 'HTTP_HOST': '127.0.0.1'}
+    setup_testing_defaults(environ)
+    status = []
+    body = b''.join(application(environ, lambda s, h, exc_info=None: status.append(s)))
+    return status[0], len(body)
+
+
+before = time.perf_counter()
+status, size = request(sys.argv[1])
+first = time.perf_counter()
+request(sys.argv[1])
+second = time.perf_counter()
+
+print(json.dumps({
+    'status': status,
+    'bytes': size,
+    'startup': app_ready - started,
+    'first_request': first - before,
+    'second_request': second - first,
+    'time_to_first_response': first - started,
+}))
+'''
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5, help='Количество запусков')
+    parser.add_argument('--path', default='/', help='Запрашиваемый адрес')
+    parser.add_argument('--warmup', action='store_true', help='Включить прогрев (QUOTES_WARMUP=True)')
+    args = parser.parse_args()
+
+    env = dict(os.environ, QUOTES_WARMUP='True' if args.warmup else 'False')
+    results = []
+    for _ in range(args.runs):
+        output = subprocess.run(
+            [sys.executable, '-c', CHILD, args.path],
+            cwd=BASE_DIR, env=env, capture_output=True, text=True, check=True,
+        ).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    print(f'{args.path}: {results[0]["status"]}, {results[0]["bytes"]} байт, запусков: {args.runs}')
+    for key in ('startup', 'first_request', 'second_request', 'time_to_first_response'):
+        values = [result[key] * 1000 for result in results]
+        print(f'  {key:<24} медиана {statistics.median(values):8.1f} мс   мин {min(values):8.1f} мс')
+
+
+if __name__ == '__main__':
+    main()